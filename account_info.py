@@ -1,10 +1,14 @@
+from datetime import date
 from tariff import Tariff
 
 
 class AccountInfo:
-    def __init__(self, current_tariff: Tariff, standing_charge: float, region_code: str, consumption, mpan: str):
+    def __init__(self, current_tariff: Tariff, standing_charge: float, region_code: str, consumption, mpan: str,
+                 data_source=None, day: date = None):
         self.current_tariff = current_tariff
         self.standing_charge = standing_charge
         self.region_code = region_code
         self.consumption = consumption
         self.mpan = mpan
+        self.data_source = data_source  # Where the consumption came from, for fetching more history
+        self.day = day or date.today()  # The day of the consumption, see BaseDataSource.comparison_day
@@ -0,0 +1,41 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+import results
+import run_schedule
+
+# Read-only JSON API over the results kept in memory by results.py and the run schedule. It never calls
+# Octopus or Home Assistant itself, so polling it is free.
+ROUTES = {
+    "/api/latest": results.latest_json,
+    "/api/intraday": results.intraday_json,
+    "/api/history": results.history_json,
+    "/api/schedule": run_schedule.schedule_json,
+}
+
+
+class ResultsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        route = ROUTES.get(self.path.split("?", 1)[0].rstrip("/"))
+        if route is None:
+            self.send_error(404)
+            return
+
+        body = route()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Don't print every poll
+
+
+def start_api_server(host: str = None, port: int = None) -> ThreadingHTTPServer:
+    """Start the API on a daemon thread so it lives alongside the scheduler loop."""
+    server = ThreadingHTTPServer((host or config.API_HOST, port or config.API_PORT), ResultsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="api-server", daemon=True).start()
+    print(f"Results API listening on http://{server.server_address[0]}:{server.server_address[1]}/api/latest")
+    return server
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import date
+import config
+import main
+import rate_table
+import async_http_client
+from account_info import AccountInfo
+from async_query_service import AsyncQueryService, rest_query_async, run_rest_steps_async
+from intraday import IntradayStore
+from queries import account_query
+
+# asyncio version of the comparison (enabled with ASYNC_IO). The token, account, consumption and every tariff's
+# rates are fetched on one event loop sharing one aiohttp session, with everything that doesn't depend on each
+# other in flight at once. Pricing, the decision and the switch are main.compare_and_switch, run in a worker
+# thread. Its GraphQL requests still go through the event loop (see AsyncQueryService.execute_gql_query).
+
+
+async def get_acc_info_async(agreement: dict, data_source) -> AccountInfo:
+    """
+    Fetch the consumption of the data source's comparison day and the standing charge for the meter found by
+    main.parse_import_agreement, as main.get_acc_info does.
+    """
+    mpan = agreement["mpan"]
+    day = data_source.comparison_day()
+
+    if (config.PREFETCH_MINUTES or config.INTRADAY_INTERVAL) and day == date.today():
+        # Only fetch the readings newer than the prefetch, as compare_and_switch does
+        consumption = await asyncio.to_thread(IntradayStore().fetch_consumption, data_source, mpan)
+    else:
+        consumption = await data_source.get_consumption_data_async(f"{day}T00:00:00Z", f"{day}T23:59:59Z")
+    standing_charge = await data_source.get_standing_charge_async()
+
+    return AccountInfo(agreement["current_tariff"], standing_charge, agreement["region_code"], consumption, mpan,
+                       data_source, day)
+
+
+async def fetch_tariff_rates_async(tariffs, region_code, day: date = None) -> dict:
+    """
+    Fetch the rates of every tariff at once.
+
+    Returns:
+        key: Tariff, value: (standing_charge, unit_rates, product_code) or the exception raised fetching them
+    """
+    all_products_task = None
+
+    def fetch(url):
+        """rest_query_async, fetching the product list only once for every tariff and only if it is needed."""
+        nonlocal all_products_task
+        if url != rate_table.all_products_url():
+            return rest_query_async(url)
+        if all_products_task is None:
+            all_products_task = asyncio.ensure_future(rest_query_async(url))
+        return all_products_task
+
+    rates = await asyncio.gather(*(run_rest_steps_async(main.tariff_rates_steps(tariff.api_display_name, region_code, day),
+                                                        fetch)
+                                   for tariff in tariffs),
+                                 return_exceptions=True)
+    return dict(zip(tariffs, rates))
+
+
+async def compare_and_switch_async():
+    """Fetch the comparison inputs concurrently, then compare and switch as compare_and_switch does."""
+    try:
+        main.query_service = await AsyncQueryService.create(config.API_KEY, config.BASE_URL)
+
+        # Finish an interrupted switch rather than starting a new comparison
+        if await asyncio.to_thread(main.resume_pending_switch):
+            return
+
+        await asyncio.to_thread(main.send_comparison_start)
+        query = account_query.format(acc_number=config.ACC_NUMBER)
+        agreement = main.parse_import_agreement(await main.query_service.execute_gql_query_async(query))
+
+        # The consumption and the rates only depend on the account, so fetch them all at once
+        tariffs = [tariff for tariff in main.tariffs if tariff != agreement["current_tariff"]]
+        data_source = main.create_account_data_source(agreement)
+        account_info, tariff_rates = await asyncio.gather(
+            get_acc_info_async(agreement, data_source),
+            fetch_tariff_rates_async(tariffs, agreement["region_code"], data_source.comparison_day()))
+
+        await asyncio.to_thread(main.compare_and_switch, account_info, tariff_rates)
+    finally:
+        await async_http_client.close_session()
+        # The query service can't be used once the loop has closed
+        main.query_service = None
+        main.query_service_created_at = None
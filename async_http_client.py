@@ -0,0 +1,29 @@
+import asyncio
+import aiohttp
+import config
+
+# Shared aiohttp session for every async request to Octopus and Home Assistant, one per event loop,
+# so all the requests of a run share a single connection pool.
+_sessions = {}
+# aiohttp.TraceConfig objects added to every session, e.g. by load_test.py to time the requests
+TRACE_CONFIGS = []
+
+
+def get_session() -> aiohttp.ClientSession:
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        if config.CASSETTE_MODE:
+            # Cassettes only record and replay http_client's requests
+            raise Exception("CASSETTE_MODE can't record or replay aiohttp requests")
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=config.ASYNC_MAX_CONNECTIONS),
+                                        timeout=aiohttp.ClientTimeout(total=60),
+                                        trace_configs=TRACE_CONFIGS)
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
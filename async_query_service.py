@@ -0,0 +1,80 @@
+import asyncio
+import async_http_client
+import json_codec
+from query_service import HEADERS
+from queries import *
+
+
+class AsyncQueryService:
+    """
+    asyncio version of QueryService, using the event loop's shared aiohttp session.
+    execute_gql_query can also be called from other threads, so sync code (e.g. the switch workflow)
+    can share the loop and its connections.
+    """
+
+    def __init__(self, api_key: str, base_url: str):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.headers = HEADERS.copy()
+        self.graphql_endpoint = f"{self.base_url}/graphql/"
+        self.token = None
+        self.loop = None
+
+    @classmethod
+    async def create(cls, api_key: str, base_url: str):
+        query_service = cls(api_key, base_url)
+        query_service.loop = asyncio.get_running_loop()
+        query_service.token = await query_service._get_token()
+        return query_service
+
+    async def _get_token(self):
+        formatted_token_query = token_query.format(api_key=self.api_key)
+
+        res = await self.execute_gql_query_async(formatted_token_query)
+        token = res.get("obtainKrakenToken", {}).get("token")
+
+        if not token:
+            raise Exception("Failed to obtain authentication token")
+
+        return token
+
+    async def execute_gql_query_async(self, query: str):
+        headers = self.headers.copy()
+        if self.token:
+            headers["Authorization"] = self.token
+
+        payload = {
+            "query": query,
+            "variables": {}
+        }
+
+        async with async_http_client.get_session().post(self.graphql_endpoint, headers=headers, json=payload) as response:
+            if not response.ok:
+                raise Exception(f"GQL query failed: {response.status}: {await response.text()}")
+            result = await json_codec.decode_async_response(response)
+
+        if "errors" in result:
+            raise Exception(f"GQL errors: {result['errors']}")
+
+        return result.get("data", {})
+
+    def execute_gql_query(self, query: str):
+        """Run a query on the event loop from another thread and wait for the result."""
+        return asyncio.run_coroutine_threadsafe(self.execute_gql_query_async(query), self.loop).result()
+
+
+async def rest_query_async(url, **kwargs):
+    async with async_http_client.get_session().get(url, **kwargs) as response:
+        if response.ok:
+            return await json_codec.decode_async_response(response)
+        raise Exception(f"ERROR: rest_query failed querying `{url}` with {response.status}")
+
+
+async def run_rest_steps_async(steps, fetch=rest_query_async):
+    """asyncio version of query_service.run_rest_steps, awaiting fetch(url) for each request."""
+    try:
+        url = next(steps)
+        while True:
+            url = steps.send(await fetch(url))
+    except StopIteration as finished:
+        return finished.value
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Offline batch evaluation of household load profiles against every tariff in a local rate dataset.
+Doesn't touch any Octopus account.
+
+Profiles are CSV (or Parquet, if pyarrow is installed) files of half-hourly consumption with a timestamp
+column (readAt, interval_start or timestamp, in UTC) and a kWh column (kwh or consumption).
+Rates are one or more rate tables written by rate_table.py (DATA_DIR/rate_table_<date>.json). Fixed-schedule
+tariffs with a rule in DATA_DIR/tariff_rules.json are priced from the rule instead, for every day of the profile.
+
+Usage:
+    python batch_evaluate.py profiles/ --rates data/rate_table_*.json --region C --output results.csv
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from multiprocessing import Pool
+import tariff_rules
+from main import calculate_potential_costs
+
+TIMESTAMP_COLUMNS = ["readAt", "interval_start", "timestamp"]
+KWH_COLUMNS = ["kwh", "consumption", "kWh"]
+
+# Rates of every tariff, set in each worker process by init_worker
+worker_tariffs = None
+
+
+def load_rate_dataset(paths, region_code: str) -> dict:
+    """
+    Merge rate tables (one per day) into the rates of each tariff for the region.
+
+    Returns:
+        key: tariff name, value: {'code', 'standing_charge', 'unit_rates', 'rule'} with unit_rates in the REST API
+        shape and rule the tariff_rules rule if it has one
+    """
+    tariffs = {}
+    for path in sorted(paths):
+        with open(path) as f:
+            table = json.load(f)
+        for name, product in table["products"].items():
+            region = product["regions"].get(region_code)
+            if region is None:
+                continue
+            tariff = tariffs.setdefault(name, {'code': product["code"], 'unit_rates': []})
+            # Tables are sorted by date, so this ends up as the latest standing charge
+            tariff['standing_charge'] = region["standing_charge"]
+            tariff['unit_rates'] += [{'valid_from': valid_from, 'valid_to': valid_to, 'value_inc_vat': value_inc_vat,
+                                      'payment_method': None}
+                                     for valid_from, valid_to, value_inc_vat in region["rates"]]
+
+    for name, tariff in tariffs.items():
+        # Newest first as the API returns them, as calculate_potential_costs takes the first rate that includes a
+        # reading, so a reading on a boundary (e.g. midnight between two tables) has to find the later rate first
+        tariff['unit_rates'].sort(key=lambda rate: rate['valid_from'], reverse=True)
+        tariff['rule'] = tariff_rules.load_rule(tariff['code'], region_code) \
+            if tariff_rules.is_fixed_schedule(name) else None
+    return tariffs
+
+
+def read_profile(path: str):
+    """Read a profile into consumption records in the same shape as the data sources return."""
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Reading Parquet profiles requires pyarrow (pip install pyarrow)")
+        rows = pyarrow.parquet.read_table(path).to_pylist()
+    else:
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    if not rows:
+        return []
+    timestamp_column = next((column for column in TIMESTAMP_COLUMNS if column in rows[0]), None)
+    kwh_column = next((column for column in KWH_COLUMNS if column in rows[0]), None)
+    if timestamp_column is None or kwh_column is None:
+        raise Exception(f"Expected a timestamp column ({', '.join(TIMESTAMP_COLUMNS)}) "
+                        f"and a kWh column ({', '.join(KWH_COLUMNS)})")
+
+    return [{
+        'readAt': format_timestamp(row[timestamp_column]),
+        'consumptionDelta': float(row[kwh_column]) * 1000,
+    } for row in rows]
+
+
+def format_timestamp(value) -> str:
+    """A CSV string or Parquet datetime as a UTC 'Z' timestamp like the data sources', assuming UTC if naive."""
+    moment = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def init_worker(tariffs):
+    global worker_tariffs
+    worker_tariffs = tariffs
+
+
+def evaluate_profile(path: str) -> dict:
+    result = {'profile': os.path.basename(path), 'days': 0, 'consumption_kwh': 0, 'costs': {}, 'cheapest': None,
+              'error': None}
+    try:
+        consumption = read_profile(path)
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+
+    days = len({entry['readAt'][:10] for entry in consumption})
+    result['days'] = days
+    result['consumption_kwh'] = round(sum(entry['consumptionDelta'] for entry in consumption) / 1000, 4)
+
+    missing_rates = []
+    for name, tariff in worker_tariffs.items():
+        unit_rates = tariff['unit_rates']
+        if tariff['rule'] and consumption:
+            read_times = [entry['readAt'] for entry in consumption]
+            period_to = tariff_rules.format_time(tariff_rules.parse_time(max(read_times)) + timedelta(minutes=30))
+            unit_rates = tariff_rules.unit_rates(tariff['rule'], min(read_times), period_to)
+        try:
+            period_costs = calculate_potential_costs(consumption, unit_rates)
+        except StopIteration:
+            # The rate dataset doesn't cover the whole profile
+            result['costs'][name] = None
+            missing_rates.append(name)
+            continue
+        total_cost = sum(period['calculated_cost'] for period in period_costs) + tariff['standing_charge'] * days
+        result['costs'][name] = round(total_cost, 4)
+
+    if missing_rates:
+        result['error'] = f"The rate tables don't cover every reading for: {', '.join(sorted(missing_rates))}"
+
+    priced = {name: cost for name, cost in result['costs'].items() if cost is not None}
+    if priced:
+        result['cheapest'] = min(priced, key=priced.get)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate load profiles against every tariff in a local rate dataset")
+    parser.add_argument("profiles", help="Directory of CSV or Parquet half-hourly load profiles")
+    parser.add_argument("--rates", nargs="+", required=True, help="Rate table JSON files (globs allowed)")
+    parser.add_argument("--region", required=True, help="Region code of the rates to use, e.g. C")
+    parser.add_argument("--output", required=True, help="Output file, .csv or .jsonl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    args = parser.parse_args()
+
+    rate_paths = [path for pattern in args.rates for path in glob.glob(pattern)]
+    tariffs = load_rate_dataset(rate_paths, args.region.upper())
+    if not tariffs:
+        sys.exit(f"No rates for region {args.region} in {', '.join(args.rates)}")
+
+    profiles = sorted(path for path in glob.glob(os.path.join(args.profiles, "*"))
+                      if path.endswith((".csv", ".parquet")))
+    tariff_names = sorted(tariffs)
+    print(f"Evaluating {len(profiles)} profiles against {len(tariff_names)} tariffs with {args.workers} workers")
+
+    with open(args.output, "w", newline="") as output, \
+            Pool(args.workers, initializer=init_worker, initargs=(tariffs,)) as pool:
+        writer = None
+        if not args.output.endswith(".jsonl"):
+            writer = csv.writer(output)
+            writer.writerow(["profile", "days", "consumption_kwh", "cheapest", "error"] + tariff_names)
+
+        # Results are written as they finish so memory doesn't grow with the number of profiles
+        for count, result in enumerate(pool.imap_unordered(evaluate_profile, profiles, chunksize=4), 1):
+            if writer:
+                writer.writerow([result['profile'], result['days'], result['consumption_kwh'], result['cheapest'],
+                                 result['error']] + [result['costs'].get(name) for name in tariff_names])
+            else:
+                output.write(json.dumps(result) + "\n")
+            if count % 100 == 0:
+                print(f"{count}/{len(profiles)} profiles evaluated")
+
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for parsing Home Assistant history.
+Compares the peak memory of loading the whole /history/period response with response.json()
+against the streaming parser, for energy sensors updating at different rates.
+No Home Assistant instance is needed, the responses are generated.
+"""
+
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+import config
+import http_client
+from data_sources.home_assistant_data_source import HomeAssistantDataSource, HISTORY_CHUNK_SIZE
+
+ENERGY_ENTITY = "sensor.benchmark_energy"
+RATE_ENTITY = "sensor.benchmark_rate"
+HISTORY_HOURS = 12
+UPDATE_INTERVALS = [60, 10, 2, 1]  # Seconds between energy sensor updates
+
+
+class FakeHistoryResponse:
+    """Serves a generated response body the same way requests does."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    @property
+    def content(self):
+        return self.body
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def generate_history(start: datetime, update_interval: int) -> bytes:
+    energy, rate = [], []
+    kwh = 1000.0
+    for second in range(0, HISTORY_HOURS * 3600, update_interval):
+        kwh += 0.0003 * update_interval
+        energy.append({"state": f"{kwh:.4f}", "last_changed": (start + timedelta(seconds=second)).isoformat()})
+    for half_hour in range(HISTORY_HOURS * 2):
+        rate.append({"state": f"{0.15 + half_hour % 5 / 100:.2f}",
+                     "last_changed": (start + timedelta(minutes=30 * half_hour)).isoformat()})
+    energy[0]["entity_id"] = ENERGY_ENTITY
+    rate[0]["entity_id"] = RATE_ENTITY
+    return json.dumps([rate, energy]).encode()
+
+
+def measure(data_source, body: bytes, stream: bool, start_date: str, end_date: str):
+    config.HA_STREAM_HISTORY = stream
+    http_client.get = lambda *args, **kwargs: FakeHistoryResponse(body)
+    # Only the consumption data is measured, not the standing charge lookup
+    data_source._fetch_standing_charge = lambda: 0
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    consumption = data_source.get_consumption_data(start_date, end_date)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return consumption, peak, elapsed
+
+
+def main():
+    config.HA_TOKEN = "benchmark"
+    config.HA_ENERGY_ENTITY = ENERGY_ENTITY
+    config.HA_RATE_ENTITY = RATE_ENTITY
+    config.HA_STANDING_CHARGE_ENTITY = "sensor.benchmark_standing_charge"
+    data_source = HomeAssistantDataSource()
+
+    start = (datetime.now(timezone.utc) - timedelta(hours=HISTORY_HOURS)).replace(minute=0, second=0, microsecond=0)
+    start_date = start.strftime('%Y-%m-%dT%H:%M:%SZ')
+    end_date = (start + timedelta(hours=HISTORY_HOURS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    print(f"Home Assistant history parsing, {HISTORY_HOURS}h of history, {HISTORY_CHUNK_SIZE // 1024} KiB chunks")
+    print(f"{'update every':>12} {'states':>8} {'response':>10} {'json() peak':>12} {'stream peak':>12} {'json() time':>12} {'stream time':>12}")
+    for update_interval in UPDATE_INTERVALS:
+        body = generate_history(start, update_interval)
+        states = HISTORY_HOURS * 3600 // update_interval
+        loaded, loaded_peak, loaded_time = measure(data_source, body, False, start_date, end_date)
+        streamed, streamed_peak, streamed_time = measure(data_source, body, True, start_date, end_date)
+
+        if loaded != streamed:
+            raise AssertionError(f"Streaming result differs from json() result at {update_interval}s updates")
+
+        print(f"{update_interval:>11}s {states:>8} {len(body) / 1024:>8.0f}KiB "
+              f"{loaded_peak / 1024:>10.0f}KiB {streamed_peak / 1024:>10.0f}KiB "
+              f"{loaded_time:>11.2f}s {streamed_time:>11.2f}s")
+
+
+if __name__ == "__main__":
+    main()
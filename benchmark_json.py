@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark for decoding API responses.
+Compares response.json() (what the requests used before json_codec) against json_codec decoding straight from
+the response bytes, with the standard library and with orjson if it is installed, on generated responses the size
+of the largest ones a comparison fetches.
+No network access is needed, the responses are generated.
+"""
+
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+import requests
+import json_codec
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REPEATS = 9
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def iso(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def telemetry_response() -> bytes:
+    """A day of smartMeterTelemetry at the 10 second resolution of a Home Mini."""
+    readings = [{"readAt": iso(START + timedelta(seconds=second)), "consumptionDelta": f"{0.0008 + second % 7 / 10000:.4f}",
+                 "costDeltaWithTax": f"{0.0192 + second % 5 / 1000:.4f}"}
+                for second in range(0, 24 * 3600, 10)]
+    return json.dumps({"data": {"smartMeterTelemetry": readings}}).encode()
+
+
+def unit_rates_response() -> bytes:
+    """A full page of Agile unit rates (1500 half hours, about a month)."""
+    rates = [{"value_exc_vat": 14.2 + slot % 48 / 10, "value_inc_vat": 14.91 + slot % 48 / 10,
+              "valid_from": iso(START + timedelta(minutes=30 * slot)),
+              "valid_to": iso(START + timedelta(minutes=30 * (slot + 1))),
+              "payment_method": None}
+             for slot in range(1500)]
+    return json.dumps({"count": 1500, "next": None, "previous": None, "results": rates}).encode()
+
+
+def consumption_response() -> bytes:
+    """A full page of REST half-hourly consumption (25000 intervals, about 17 months)."""
+    readings = [{"consumption": round(0.1 + slot % 11 / 20, 3),
+                 "interval_start": iso(START + timedelta(minutes=30 * slot)),
+                 "interval_end": iso(START + timedelta(minutes=30 * (slot + 1)))}
+                for slot in range(25000)]
+    return json.dumps({"count": 25000, "next": None, "previous": None, "results": readings}).encode()
+
+
+def history_response() -> bytes:
+    """12 hours of Home Assistant history for a sensor updating every second (the HA_STREAM_HISTORY=false path)."""
+    energy = [{"state": f"{1000 + second * 0.0003:.4f}", "last_changed": (START + timedelta(seconds=second)).isoformat()}
+              for second in range(12 * 3600)]
+    rate = [{"state": f"{0.15 + half_hour % 5 / 100:.2f}",
+             "last_changed": (START + timedelta(minutes=30 * half_hour)).isoformat()}
+            for half_hour in range(24)]
+    energy[0]["entity_id"] = "sensor.benchmark_energy"
+    rate[0]["entity_id"] = "sensor.benchmark_rate"
+    return json.dumps([rate, energy]).encode()
+
+
+def make_response(body: bytes) -> requests.Response:
+    response = requests.Response()
+    response._content = body
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+def median_time(decode, body: bytes) -> float:
+    times = []
+    for _ in range(REPEATS):
+        response = make_response(body)
+        started = time.perf_counter()
+        decode(response)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main():
+    payloads = [
+        ("GraphQL telemetry", telemetry_response()),
+        ("REST unit rates", unit_rates_response()),
+        ("REST consumption", consumption_response()),
+        ("HA history", history_response()),
+    ]
+    decoders = [("response.json()", lambda response: response.json()),
+                ("json bytes", lambda response: json.loads(response.content))]
+    if orjson is not None:
+        decoders.append(("orjson bytes", lambda response: orjson.loads(response.content)))
+    else:
+        print("orjson is not installed, only the standard library is compared")
+
+    print(f"json_codec is using {json_codec.DECODER}, median of {REPEATS} runs")
+    print(f"{'payload':<18} {'size':>9} " + " ".join(f"{name:>16}" for name, _ in decoders) + f" {'speedup':>8}")
+    for name, body in payloads:
+        times = [median_time(decode, body) for _, decode in decoders]
+        print(f"{name:<18} {len(body) / 1024:>6.0f}KiB " + " ".join(f"{t * 1000:>14.1f}ms" for t in times)
+              + f" {times[0] / times[-1]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
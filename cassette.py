@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+from collections import defaultdict
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Record/replay of every HTTP exchange with Octopus and Home Assistant, so a night's run can be
+# reproduced and benchmarked offline. Cassettes are gzipped JSON lines, one exchange per line.
+RECORD = "record"
+REPLAY = "replay"
+
+# Secrets that appear in bodies rather than headers (headers other than Content-Type aren't recorded)
+REDACTIONS = [
+    (re.compile(r'(APIKey:\s*\\?")[^"\\]*'), r"\1REDACTED"),
+    (re.compile(r'("token"\s*:\s*")[^"]*'), r"\1REDACTED"),
+]
+# Dates are left out of the lookup key so that a cassette can be replayed on a later day
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def exchange_key(method: str, url: str, body) -> str:
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    body_hash = hashlib.sha1(DATE_PATTERN.sub("DATE", redact(body or "")).encode()).hexdigest()
+    return f"{method} {DATE_PATTERN.sub('DATE', url)} {body_hash}"
+
+
+class CassetteAdapter(HTTPAdapter):
+    """Transport adapter that records responses to, or replays them from, a cassette file."""
+
+    def __init__(self, path: str, mode: str):
+        super().__init__()
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        # Recorded responses per key, served in the order they were recorded
+        self._recorded = defaultdict(list)
+        if mode == REPLAY:
+            self._load()
+
+    def _load(self):
+        with gzip.open(self.path, "rt") as f:
+            for line in f:
+                exchange = json.loads(line)
+                self._recorded[exchange["key"]].append(exchange)
+
+    def send(self, request, **kwargs):
+        key = exchange_key(request.method, request.url, request.body)
+        if self.mode == REPLAY:
+            return self._replay(request, key)
+
+        response = super().send(request, **kwargs)
+        exchange = {
+            "key": key,
+            "method": request.method,
+            "url": request.url,
+            "status": response.status_code,
+            "reason": response.reason,
+            "content_type": response.headers.get("Content-Type"),
+            "body": redact(response.text),
+        }
+        with self._lock, gzip.open(self.path, "at") as f:
+            f.write(json.dumps(exchange, separators=(",", ":")) + "\n")
+        return response
+
+    def _replay(self, request, key):
+        with self._lock:
+            exchanges = self._recorded.get(key)
+            if not exchanges:
+                raise requests.ConnectionError(f"No recorded response for {request.method} {request.url}")
+            # Keep serving the last response once the recorded ones have been used up
+            exchange = exchanges.pop(0) if len(exchanges) > 1 else exchanges[0]
+
+        response = requests.Response()
+        response.status_code = exchange["status"]
+        response.reason = exchange["reason"]
+        response.headers = CaseInsensitiveDict({"Content-Type": exchange["content_type"] or "application/json"})
+        response._content = exchange["body"].encode("utf-8")
+        # The body is already read, so iter_content (used by streamed requests) serves it instead of reading raw
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+
+def install_cassette(session: requests.Session, path: str, mode: str):
+    if mode not in [RECORD, REPLAY]:
+        raise ValueError(f"Unknown cassette mode '{mode}', expected '{RECORD}' or '{REPLAY}'")
+
+    adapter = CassetteAdapter(path, mode)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    print(f"HTTP cassette: {mode} {path}")
+    return adapter
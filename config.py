@@ -14,6 +14,10 @@ NOTIFICATION_URLS = os.getenv("NOTIFICATION_URLS", "")
 BATCH_NOTIFICATIONS = os.getenv("BATCH_NOTIFICATIONS", "false") in ["true", "True", "1"]
 
 EXECUTION_TIME = os.getenv("EXECUTION_TIME", "23:00")
+# Minutes after EXECUTION_TIME to spread the comparisons of the accounts sharing DATA_DIR over (see run_schedule.py)
+RUN_SPREAD_WINDOW = float(os.getenv("RUN_SPREAD_WINDOW", "15"))
+# Requests per second the spread comparisons should stay under, lowered further when the API returns errors
+RUN_SPREAD_MAX_REQUEST_RATE = float(os.getenv("RUN_SPREAD_MAX_REQUEST_RATE", "5"))
 
 # List of tariff IDs to compare
 TARIFFS = os.getenv("TARIFFS", "go,agile,flexible")
@@ -30,3 +34,95 @@ HA_TOKEN = os.getenv("HA_TOKEN", "")
 HA_ENERGY_ENTITY = os.getenv("HA_ENERGY_ENTITY", "")
 HA_RATE_ENTITY = os.getenv("HA_RATE_ENTITY", "")
 HA_STANDING_CHARGE_ENTITY = os.getenv("HA_STANDING_CHARGE_ENTITY", "")
+
+# Directory for files the bot keeps between runs (e.g. the shared rate table)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Time (HH:MM) to materialise the shared rate table for every tariff and region. Empty disables it.
+RATE_TABLE_TIME = os.getenv("RATE_TABLE_TIME", "")
+# Comma-separated list of region codes to include in the shared rate table. Empty includes every region in the
+# table built at RATE_TABLE_TIME, and only the account's own region in the one built by the prefetch
+RATE_TABLE_REGIONS = os.getenv("RATE_TABLE_REGIONS", "")
+# Days of rate tables (and catalogue rate tables) to keep in DATA_DIR, counting today. Older ones are deleted when
+# a new one is built. Keep more to use them with batch_evaluate.py
+RATE_TABLE_KEEP_DAYS = max(int(os.getenv("RATE_TABLE_KEEP_DAYS", "1")), 1)
+# Generate the rates of fixed-schedule tariffs (Go, Cosy, Flexible) from their cached daily windows
+TARIFF_RULES = os.getenv("TARIFF_RULES", "true").lower() == "true"
+
+# Load shifting what-if: flexible load (kWh per day, e.g. EV charging) that could be moved into each tariff's
+# cheapest half-hours. When set, tariffs are ranked by their cost after shifting. 0 disables it.
+SHIFTABLE_KWH = float(os.getenv("SHIFTABLE_KWH", "0"))
+# Maximum extra power (kW) the shifted load can draw in any half-hour
+SHIFT_MAX_KW = float(os.getenv("SHIFT_MAX_KW", "7"))
+# Local time window (HH:MM-HH:MM) the load can be moved into. Empty allows the whole day
+SHIFT_WINDOW = os.getenv("SHIFT_WINDOW", "")
+
+# Port for the HTTP API serving the latest comparison results as JSON. 0 disables it.
+API_PORT = int(os.getenv("API_PORT", "0"))
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+
+# Opt-in profiling of comparison runs. Comma-separated list of: cprofile, tracemalloc, sample. Empty disables it.
+PROFILE_MODE = os.getenv("PROFILE_MODE", "")
+# Directory the profile dumps are written to, one set of files per run
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+# Interval between stack samples in milliseconds
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "5"))
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+PROFILE_TOP_ALLOCATIONS = int(os.getenv("PROFILE_TOP_ALLOCATIONS", "25"))
+
+# Minutes between incremental intraday cost updates (only new consumption is fetched). 0 disables them.
+INTRADAY_INTERVAL = int(os.getenv("INTRADAY_INTERVAL", "0"))
+
+# Record every HTTP exchange to a cassette file, or replay a recorded one without network access.
+# One of: record, replay. Empty disables it.
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", os.path.join(DATA_DIR, "cassette.jsonl.gz"))
+
+# Also compare against every matching import product in the Octopus catalogue (comparison only)
+COMPARE_CATALOG = os.getenv("COMPARE_CATALOG", "false") in ["true", "True", "1"]
+# Regex matched against catalogue product codes and names to pick the candidates
+CATALOG_PRODUCTS = os.getenv("CATALOG_PRODUCTS", "agile|go|cosy|flexible|tracker|intelligent")
+# Comma-separated dates (YYYY-MM-DD) to also look the catalogue up at, to include historic product versions
+CATALOG_AVAILABLE_AT = os.getenv("CATALOG_AVAILABLE_AT", "")
+# Number of products whose rates are downloaded at the same time
+CATALOG_FETCH_WORKERS = int(os.getenv("CATALOG_FETCH_WORKERS", "8"))
+# Number of cheapest catalogue products to list in the summary
+CATALOG_SUMMARY_SIZE = int(os.getenv("CATALOG_SUMMARY_SIZE", "5"))
+
+# Parse Home Assistant history as it downloads instead of loading the whole response into memory
+HA_STREAM_HISTORY = os.getenv("HA_STREAM_HISTORY", "true") in ["true", "True", "1"]
+
+# How to decide whether to switch: "savings" switches when today is more than 2p cheaper, "risk" also requires
+# the new tariff's simulated monthly cost at RISK_PERCENTILE to be no higher than the current tariff's
+SWITCH_POLICY = os.getenv("SWITCH_POLICY", "savings").lower()
+# Whether to include the simulated monthly costs in the summary (always done for the risk policy)
+RISK_ANALYSIS = os.getenv("RISK_ANALYSIS", "false") in ["true", "True", "1"]
+# Days of consumption and price history to resample
+RISK_HISTORY_DAYS = int(os.getenv("RISK_HISTORY_DAYS", "30"))
+# Number of simulated months
+RISK_SCENARIOS = int(os.getenv("RISK_SCENARIOS", "20000"))
+# Percentile of the monthly cost compared by the risk policy. One of the percentiles in the risk report, checked
+# when the comparison runs (see main.check_risk_settings)
+RISK_PERCENTILES = [5, 50, 95, 99]
+RISK_PERCENTILE = int(os.getenv("RISK_PERCENTILE", "95"))
+
+# Minutes before EXECUTION_TIME to fetch the token, rates, catalogue and consumption so far, so that the
+# comparison only has to fetch the newest readings. 0 disables it.
+PREFETCH_MINUTES = int(os.getenv("PREFETCH_MINUTES", "0"))
+
+# How to use the consumption data sources when more than one is available (e.g. Home Assistant and a Home Mini).
+# "first" uses the first available, "hedged" queries them all at once and uses the first complete result,
+# "fallback" tries them in order, each within its latency budget.
+DATA_SOURCE_MODE = os.getenv("DATA_SOURCE_MODE", "first").lower()
+# Latency budget in seconds per data source, e.g. "home_assistant=10,octopus=30"
+DATA_SOURCE_BUDGETS = os.getenv("DATA_SOURCE_BUDGETS", "")
+# Latency budget in seconds for data sources not in DATA_SOURCE_BUDGETS
+DATA_SOURCE_BUDGET = float(os.getenv("DATA_SOURCE_BUDGET", "60"))
+
+# Run the comparison on asyncio (aiohttp) so the account, consumption and every tariff's rates are fetched at once
+ASYNC_IO = os.getenv("ASYNC_IO", "false") in ["true", "True", "1"]
+# Maximum simultaneous connections of the shared aiohttp session
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "100"))
+
+# JSON decoder for API responses: "auto" uses orjson if it is installed, "json" always uses the standard library
+JSON_DECODER = os.getenv("JSON_DECODER", "auto").lower()
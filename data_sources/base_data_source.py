@@ -1,4 +1,6 @@
+import asyncio
 from abc import ABC, abstractmethod
+from datetime import date
 from typing import List, Dict, Any
 
 
@@ -46,3 +48,17 @@ class BaseDataSource(ABC):
             True if the data source can be used, False otherwise
         """
         pass
+
+    def comparison_day(self) -> date:
+        """The latest day this data source has a full day of readings for by the end of it. Today unless they lag."""
+        return date.today()
+
+    async def get_consumption_data_async(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """
+        asyncio version of get_consumption_data. Runs it in a thread unless the data source has a native one.
+        """
+        return await asyncio.to_thread(self.get_consumption_data, start_date, end_date)
+
+    async def get_standing_charge_async(self) -> float:
+        """asyncio version of get_standing_charge. Runs it in a thread unless the data source has a native one."""
+        return await asyncio.to_thread(self.get_standing_charge)
@@ -1,23 +1,30 @@
-from typing import Optional
+from typing import Dict, List, Tuple
 import config
 from .base_data_source import BaseDataSource
 from .octopus_data_source import OctopusDataSource
 from .home_assistant_data_source import HomeAssistantDataSource
-from notification import send_notification
+from .octopus_rest_data_source import OctopusRestDataSource
+from .hedged_data_source import HedgedDataSource, HEDGED, FALLBACK
 
 
 class DataSourceFactory:
     """Factory class to create the appropriate data source based on configuration."""
     
     @staticmethod
-    def create_data_source(query_service=None, device_id: str = None, current_standing_charge: float = None) -> BaseDataSource:
+    def create_data_source(query_service=None, device_id: str = None, current_standing_charge: float = None,
+                           mpan: str = None, meter_serial: str = None, product_code: str = None,
+                           tariff_code: str = None) -> BaseDataSource:
         """
         Create and return the appropriate data source based on configuration.
         
         Args:
             query_service: Octopus GraphQL query service (for Octopus data source)
             device_id: Octopus device ID (for Octopus data source)
-            current_standing_charge: Current standing charge from Octopus (for Octopus data source)
+            current_standing_charge: Current standing charge from Octopus (for Octopus data sources)
+            mpan: Import MPAN (for Octopus REST data source)
+            meter_serial: Meter serial number (for Octopus REST data source)
+            product_code: Current product code (for Octopus REST data source)
+            tariff_code: Current tariff code (for Octopus REST data source)
             
         Returns:
             BaseDataSource: The configured data source
@@ -25,36 +32,81 @@ class DataSourceFactory:
         Raises:
             Exception: If no valid data source can be created
         """
+        sources = DataSourceFactory._available_sources(query_service, device_id, current_standing_charge, mpan,
+                                                       meter_serial, product_code, tariff_code)
+        if not sources:
+            raise Exception("No valid data source available. Please check your configuration.")
+
+        if config.DATA_SOURCE_MODE in [HEDGED, FALLBACK] and len(sources) > 1:
+            print(f"Using {', '.join(name for name, _ in sources)} data sources ({config.DATA_SOURCE_MODE})")
+            return HedgedDataSource(sources, config.DATA_SOURCE_MODE, DataSourceFactory._budgets(),
+                                    config.DATA_SOURCE_BUDGET)
+
+        name, data_source = sources[0]
+        if name == "home_assistant":
+            print("Using Home Assistant data source")
+        elif name == "octopus":
+            print("Using Octopus Energy data source")
+        else:
+            print("No Octopus Home Mini found, using Octopus Energy REST consumption data source")
+        return data_source
+
+    @staticmethod
+    def _available_sources(query_service, device_id, current_standing_charge, mpan, meter_serial, product_code,
+                           tariff_code) -> List[Tuple[str, BaseDataSource]]:
+        """The data sources that can be used, in order of preference."""
+        sources = []
+
         # Check if Home Assistant configuration is provided
         if hasattr(config, 'HA_ENERGY_ENTITY') and config.HA_ENERGY_ENTITY:
             ha_data_source = HomeAssistantDataSource()
             if ha_data_source.is_available():
-                print("Using Home Assistant data source")
-                return ha_data_source
+                sources.append(("home_assistant", ha_data_source))
             else:
                 print("Home Assistant configuration incomplete, falling back to Octopus")
-        
-        # Fall back to Octopus data source
+
+        # Then the Octopus data source
         if query_service and device_id is not None and current_standing_charge is not None:
             octopus_data_source = OctopusDataSource(query_service, device_id, current_standing_charge)
             if octopus_data_source.is_available():
-                print("Using Octopus Energy data source")
-                return octopus_data_source
-        
-        raise Exception("No valid data source available. Please check your configuration.")
-    
+                sources.append(("octopus", octopus_data_source))
+
+        # Without an Octopus Home Mini, fall back to the REST consumption endpoint. Its readings lag by a day,
+        # so it is only worth hedging with when there is nothing else.
+        if current_standing_charge is not None and not sources:
+            rest_data_source = OctopusRestDataSource(mpan, meter_serial, product_code, tariff_code, current_standing_charge)
+            if rest_data_source.is_available():
+                sources.append(("octopus_rest", rest_data_source))
+
+        return sources
+
+    @staticmethod
+    def _budgets() -> Dict[str, float]:
+        """Parse DATA_SOURCE_BUDGETS, e.g. "home_assistant=10,octopus=30". Key: source name, value: seconds."""
+        budgets = {}
+        for budget in config.DATA_SOURCE_BUDGETS.split(","):
+            if "=" in budget:
+                name, seconds = budget.split("=", 1)
+                budgets[name.strip()] = float(seconds)
+        return budgets
+
     @staticmethod
     def get_data_source_info() -> dict:
         """
         Get information about which data source would be used.
+        Whether "octopus" is the Home Mini telemetry or the REST consumption endpoint is only known once the
+        account has been looked up, see create_data_source.
         
         Returns:
-            dict: Information about the data source selection
+            dict: Information about the data source selection. sources lists the available sources in order of
+            preference, and selected_source is the one used, or DATA_SOURCE_MODE if they are hedged/fallen back on
         """
         info = {
             "ha_configured": False,
             "ha_available": False,
             "octopus_available": False,
+            "mode": config.DATA_SOURCE_MODE,
+            "sources": [],
             "selected_source": None
         }
         
@@ -63,14 +115,17 @@ class DataSourceFactory:
             info["ha_configured"] = True
             ha_data_source = HomeAssistantDataSource()
             info["ha_available"] = ha_data_source.is_available()
-            
             if info["ha_available"]:
-                info["selected_source"] = "home_assistant"
-                return info
+                info["sources"].append("home_assistant")
         
         # Check Octopus configuration
         info["octopus_available"] = bool(config.API_KEY and config.ACC_NUMBER)
         if info["octopus_available"]:
-            info["selected_source"] = "octopus"
+            info["sources"].append("octopus")
+
+        if config.DATA_SOURCE_MODE in [HEDGED, FALLBACK] and len(info["sources"]) > 1:
+            info["selected_source"] = config.DATA_SOURCE_MODE
+        elif info["sources"]:
+            info["selected_source"] = info["sources"][0]
         
         return info
@@ -0,0 +1,114 @@
+import codecs
+import json
+import math
+from bisect import bisect_right
+from datetime import datetime
+from typing import Any, Iterable, Iterator, Tuple
+
+# Incremental parsing of Home Assistant's /history/period response, so that high-frequency sensors
+# never have all their states in memory at once.
+PERIOD_SECONDS = 30 * 60
+
+
+class HistoryStateParser:
+    """
+    Incremental parser of a history response (a JSON array with an array of states per entity). Feed it the
+    bytes as they arrive and it yields the (entity_index, state) pairs completed so far. Only one state
+    object is decoded at a time.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.entity_index = -1
+
+    def feed(self, chunk: bytes) -> Iterator[Tuple[int, dict]]:
+        """Yields the states completed by the chunk. Must be exhausted before the next chunk is fed."""
+        buffer = self.buffer = self.buffer[self.position:] + self.utf8_decoder.decode(chunk)
+        position = 0
+        while position < len(buffer):
+            char = buffer[position]
+            if char in " \t\r\n,":
+                position += 1
+            elif char == "[":
+                self.depth += 1
+                if self.depth == 2:
+                    self.entity_index += 1
+                position += 1
+            elif char == "]":
+                self.depth -= 1
+                position += 1
+            elif char == "{" and self.depth == 2:
+                try:
+                    state, end = self.decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    break  # The rest of the state hasn't arrived yet
+                yield self.entity_index, state
+                position = end
+            else:
+                raise ValueError(f"Unexpected {char!r} in history response")
+        self.position = position
+
+    def close(self):
+        if self.depth != 0 or self.buffer[self.position:].strip():
+            raise ValueError("History response ended unexpectedly")
+
+
+def iter_history_states(chunks: Iterable[bytes]) -> Iterator[Tuple[int, dict]]:
+    """Yield (entity_index, state) from a history response as the bytes arrive."""
+    parser = HistoryStateParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.close()
+
+
+class HalfHourBuckets:
+    """
+    Folds an entity's states into half-hour buckets, keeping only the latest state in each (end - 30 min, end].
+    Memory depends on the time span covered rather than on how often the sensor updates, and states can
+    arrive in any order.
+    """
+
+    def __init__(self):
+        self.first_changed = None
+        # key: bucket end (epoch seconds), value: (last_changed epoch seconds, state)
+        self._buckets = {}
+        self._bucket_ends = None
+
+    def add(self, state: dict):
+        changed = datetime.fromisoformat(state['last_changed'].replace('Z', '+00:00'))
+        changed_ts = changed.timestamp()
+        bucket_end = math.ceil(changed_ts / PERIOD_SECONDS) * PERIOD_SECONDS
+
+        latest = self._buckets.get(bucket_end)
+        if latest is None or changed_ts >= latest[0]:
+            self._buckets[bucket_end] = (changed_ts, state['state'])
+        if self.first_changed is None or changed < self.first_changed:
+            self.first_changed = changed
+        self._bucket_ends = None
+
+    def reading_at(self, boundary: datetime) -> Any:
+        """The state of the latest reading at or before a half-hour boundary, or None."""
+        if self._bucket_ends is None:
+            self._bucket_ends = sorted(self._buckets)
+
+        index = bisect_right(self._bucket_ends, boundary.timestamp()) - 1
+        return self._buckets[self._bucket_ends[index]][1] if index >= 0 else None
+
+
+class HistoryBuckets:
+    """Folds the states of every entity in a history response into its HalfHourBuckets, as they are parsed."""
+
+    def __init__(self):
+        # key: entity_id, value: HalfHourBuckets
+        self.entities = {}
+        self._entity_ids = {}
+
+    def add(self, entity_index: int, state: dict):
+        # With minimal_response only the first state of each entity carries the entity_id
+        if 'entity_id' in state:
+            self._entity_ids[entity_index] = state['entity_id']
+        self.entities.setdefault(self._entity_ids[entity_index], HalfHourBuckets()).add(state)
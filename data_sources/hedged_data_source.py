@@ -0,0 +1,234 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Tuple
+from .base_data_source import BaseDataSource
+
+HEDGED = "hedged"
+FALLBACK = "fallback"
+
+# A result is complete if its latest reading is this close to the end of the requested range (or now)
+COMPLETE_WITHIN = timedelta(hours=1)
+
+
+def validate_consumption(consumption, start_date: str, end_date: str) -> Tuple[bool, bool]:
+    """
+    Check a data source's result.
+
+    Returns:
+        (valid, complete): valid if every record is well formed, complete if it is valid and the readings
+        reach the end of the range, or now if the range hasn't ended yet
+    """
+    if not isinstance(consumption, list):
+        return False, False
+    try:
+        for entry in consumption:
+            float(entry['consumptionDelta'])
+            datetime.fromisoformat(entry['readAt'].replace('Z', '+00:00'))
+    except (KeyError, TypeError, ValueError):
+        return False, False
+
+    if not consumption:
+        return True, False
+    last_read_at = max(datetime.fromisoformat(entry['readAt'].replace('Z', '+00:00')) for entry in consumption)
+    range_end = min(datetime.fromisoformat(end_date.replace('Z', '+00:00')), datetime.now(timezone.utc))
+    return True, last_read_at >= range_end - COMPLETE_WITHIN
+
+
+class HedgedDataSource(BaseDataSource):
+    """
+    Data source that asks several data sources for the same readings, so one that fails or is slow doesn't fail
+    the run.
+
+    In hedged mode every source is queried at once and the first complete result is used. In fallback mode the
+    sources are tried in order, each within its latency budget. If no source returns a complete result, the
+    valid result with the most readings is used.
+    """
+
+    def __init__(self, sources: List[Tuple[str, BaseDataSource]], mode: str, budgets: Dict[str, float],
+                 default_budget: float):
+        self.sources = sources
+        self.mode = mode
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.winner = None
+        # Outcome of the last get_consumption_data call: mode, winner, seconds taken and errors per source
+        self.last_fetch = None
+
+    def budget(self, name: str) -> float:
+        return self.budgets.get(name, self.default_budget)
+
+    def get_consumption_data(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        fetch = ConsumptionFetch(self, start_date, end_date)
+        executor = ThreadPoolExecutor(max_workers=len(self.sources))
+
+        def fetch_source(name, source):
+            source_started = time.monotonic()
+            try:
+                return source.get_consumption_data(start_date, end_date)
+            finally:
+                fetch.record_time(name, source_started)
+
+        try:
+            if self.mode == HEDGED:
+                futures = {executor.submit(fetch_source, name, source): name for name, source in self.sources}
+                pending = set(futures)
+                while pending and fetch.winner is None:
+                    done, pending = wait(pending, timeout=fetch.time_left(), return_when=FIRST_COMPLETED)
+                    if not done:
+                        break  # Out of time
+                    fetch.accept_first(done, futures)
+            else:
+                for name, source in self.sources:
+                    source_started = time.monotonic()
+                    future = executor.submit(fetch_source, name, source)
+                    wait([future], timeout=self.budget(name))
+                    if not future.done():
+                        fetch.time_out(name, source_started)
+                    elif fetch.accept(name, future):
+                        break
+        finally:
+            # Don't wait for slow sources that lost
+            executor.shutdown(wait=False)
+
+        return self._finish(fetch)
+
+    async def get_consumption_data_async(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        fetch = ConsumptionFetch(self, start_date, end_date)
+
+        async def fetch_source(name, source):
+            source_started = time.monotonic()
+            try:
+                return await source.get_consumption_data_async(start_date, end_date)
+            finally:
+                fetch.record_time(name, source_started)
+
+        tasks = {}
+        try:
+            if self.mode == HEDGED:
+                tasks = {asyncio.ensure_future(fetch_source(name, source)): name for name, source in self.sources}
+                pending = set(tasks)
+                while pending and fetch.winner is None:
+                    done, pending = await asyncio.wait(pending, timeout=fetch.time_left(),
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        break  # Out of time
+                    fetch.accept_first(done, tasks)
+            else:
+                for name, source in self.sources:
+                    source_started = time.monotonic()
+                    task = asyncio.ensure_future(fetch_source(name, source))
+                    tasks[task] = name
+                    await asyncio.wait([task], timeout=self.budget(name))
+                    if not task.done():
+                        fetch.time_out(name, source_started)
+                    elif fetch.accept(name, task):
+                        break
+        finally:
+            # Unlike threads, slow sources that lost can be stopped
+            for task in tasks:
+                task.cancel()
+
+        return self._finish(fetch)
+
+    def _finish(self, fetch: "ConsumptionFetch"):
+        """Record the outcome of a fetch and return the winning result."""
+        winner = fetch.winner
+        if winner is None and fetch.partial:
+            winner = max(fetch.partial, key=lambda name: len(fetch.partial[name]))
+
+        self.winner = winner
+        self.last_fetch = {
+            "mode": self.mode,
+            "winner": winner,
+            "complete": winner is not None
+                        and validate_consumption(fetch.partial[winner], fetch.start_date, fetch.end_date)[1],
+            "seconds": dict(fetch.timings),
+            "errors": dict(fetch.errors),
+        }
+        print(f"Data sources ({self.mode}): using {winner or 'none'}, took "
+              + ", ".join(f"{name} {seconds}s" for name, seconds in fetch.timings.items())
+              + "".join(f"; {name} failed: {error}" for name, error in fetch.errors.items()))
+
+        if winner is None:
+            raise Exception(f"No data source returned consumption data: {fetch.errors}")
+        return fetch.partial[winner]
+
+    def get_standing_charge(self) -> float:
+        """Get the standing charge from the source that provided the consumption data, or the first that works."""
+        sources = sorted(self.sources, key=lambda source: source[0] != self.winner)
+        errors = []
+        for name, source in sources:
+            try:
+                return source.get_standing_charge()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+        raise Exception(f"No data source returned a standing charge: {'; '.join(errors)}")
+
+    async def get_standing_charge_async(self) -> float:
+        sources = sorted(self.sources, key=lambda source: source[0] != self.winner)
+        errors = []
+        for name, source in sources:
+            try:
+                return await source.get_standing_charge_async()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+        raise Exception(f"No data source returned a standing charge: {'; '.join(errors)}")
+
+    def is_available(self) -> bool:
+        return any(source.is_available() for _, source in self.sources)
+
+    def _position(self, name: str) -> int:
+        return next(index for index, (source_name, _) in enumerate(self.sources) if source_name == name)
+
+
+class ConsumptionFetch:
+    """
+    The progress of one get_consumption_data call of a HedgedDataSource, the same for its threads and its
+    asyncio tasks: how long each source took, why it failed, the valid results so far and the winner.
+    """
+
+    def __init__(self, data_source: HedgedDataSource, start_date: str, end_date: str):
+        self.data_source = data_source
+        self.start_date = start_date
+        self.end_date = end_date
+        self.started = time.monotonic()
+        self.timings, self.errors, self.partial = {}, {}, {}
+        self.winner = None
+
+    def time_left(self) -> float:
+        """Seconds until the hedged sources are out of time, the longest of their budgets."""
+        budget = max(self.data_source.budget(name) for name, _ in self.data_source.sources)
+        return max(0, self.started + budget - time.monotonic())
+
+    def record_time(self, name: str, source_started: float):
+        self.timings[name] = round(time.monotonic() - source_started, 3)
+
+    def time_out(self, name: str, source_started: float):
+        self.errors[name] = f"No result within {self.data_source.budget(name)}s"
+        self.record_time(name, source_started)
+
+    def accept(self, name: str, future) -> bool:
+        """Record a finished fetch (a future or a task). Returns whether it is a complete result, the winner."""
+        try:
+            consumption = future.result()
+        except Exception as e:
+            self.errors[name] = str(e)
+            return False
+        valid, complete = validate_consumption(consumption, self.start_date, self.end_date)
+        if not valid:
+            self.errors[name] = "Invalid consumption data"
+            return False
+        self.partial[name] = consumption
+        if complete:
+            self.winner = name
+        return complete
+
+    def accept_first(self, done, names: dict) -> bool:
+        """Accept the finished fetches until one is complete. names: key: future or task, value: source name."""
+        # Prefer the earlier source if several finished together
+        for future in sorted(done, key=lambda future: self.data_source._position(names[future])):
+            if self.accept(names[future], future):
+                return True
+        return False
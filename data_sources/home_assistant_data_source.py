@@ -1,8 +1,17 @@
 from typing import List, Dict, Any
 from datetime import datetime, timedelta
-import requests
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import async_http_client
+import http_client
+import json_codec
 import config
 from .base_data_source import BaseDataSource
+from profiling import profiled_section
+from .ha_history_stream import iter_history_states, HistoryStateParser, HalfHourBuckets, HistoryBuckets
+
+# Bytes read from the history response at a time when streaming it
+HISTORY_CHUNK_SIZE = 64 * 1024
 
 
 class HomeAssistantDataSource(BaseDataSource):
@@ -14,20 +23,31 @@ class HomeAssistantDataSource(BaseDataSource):
         self.energy_entity = config.HA_ENERGY_ENTITY
         self.rate_entity = config.HA_RATE_ENTITY
         self.standing_charge_entity = config.HA_STANDING_CHARGE_ENTITY
+        self._standing_charge_future = None
+        self._standing_charge_task = None
         
         self.headers = {
             "Authorization": f"Bearer {self.ha_token}",
             "Content-Type": "application/json"
         }
     
+    @profiled_section("HomeAssistantDataSource.get_consumption_data")
     def get_consumption_data(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
         """Get consumption data from Home Assistant."""
         try:
-            # Get energy history data
-            energy_history = self._get_entity_history(self.energy_entity, start_date, end_date)
-            
-            # Get rate history data
-            rate_history = self._get_entity_history(self.rate_entity, start_date, end_date)
+            # The standing charge is a single state lookup, so fetch it while the history downloads
+            executor = ThreadPoolExecutor(max_workers=1)
+            self._standing_charge_future = executor.submit(self._fetch_standing_charge)
+            executor.shutdown(wait=False)
+
+            if config.HA_STREAM_HISTORY:
+                # Fold the states into 30-minute intervals as they are downloaded
+                return self._stream_consumption_data(start_date, end_date)
+
+            # Get energy and rate history data in a single request
+            histories = self._get_entities_history([self.energy_entity, self.rate_entity], start_date, end_date)
+            energy_history = histories.get(self.energy_entity, [])
+            rate_history = histories.get(self.rate_entity, [])
             
             # Process data into 30-minute intervals
             consumption_data = self._process_consumption_data(energy_history, rate_history)
@@ -37,24 +57,73 @@ class HomeAssistantDataSource(BaseDataSource):
         except Exception as e:
             raise Exception(f"Failed to get consumption data from Home Assistant: {e}")
     
+    @profiled_section("HomeAssistantDataSource.get_standing_charge")
     def get_standing_charge(self) -> float:
         """Get the current standing charge from Home Assistant."""
         try:
-            response = requests.get(
-                f"{self.ha_url}/states/{self.standing_charge_entity}",
-                headers=self.headers,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            standing_charge_pounds = float(data['state'])
-            
-            # Convert from pounds to pence
-            return standing_charge_pounds * 100
+            # Use the lookup started alongside the consumption data if there is one
+            standing_charge_future, self._standing_charge_future = self._standing_charge_future, None
+            if standing_charge_future is not None:
+                return standing_charge_future.result()
+
+            return self._fetch_standing_charge()
             
         except Exception as e:
             raise Exception(f"Failed to get standing charge from Home Assistant: {e}")
+
+    async def get_consumption_data_async(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """Get consumption data from Home Assistant without blocking the event loop."""
+        try:
+            # As in get_consumption_data, the standing charge is fetched while the history downloads
+            self._standing_charge_task = asyncio.ensure_future(self._fetch_standing_charge_async())
+
+            buckets = HistoryBuckets()
+            parser = HistoryStateParser()
+            url, params = self._history_request_args([self.energy_entity, self.rate_entity], start_date, end_date)
+            async with async_http_client.get_session().get(url, params=params, headers=self.headers) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(HISTORY_CHUNK_SIZE):
+                    for entity_index, state in parser.feed(chunk):
+                        buckets.add(entity_index, state)
+            parser.close()
+
+            return self._periods_from_buckets(buckets)
+
+        except Exception as e:
+            raise Exception(f"Failed to get consumption data from Home Assistant: {e}")
+
+    async def get_standing_charge_async(self) -> float:
+        try:
+            standing_charge_task, self._standing_charge_task = self._standing_charge_task, None
+            if standing_charge_task is not None:
+                return await standing_charge_task
+
+            return await self._fetch_standing_charge_async()
+
+        except Exception as e:
+            raise Exception(f"Failed to get standing charge from Home Assistant: {e}")
+
+    async def _fetch_standing_charge_async(self) -> float:
+        async with async_http_client.get_session().get(f"{self.ha_url}/states/{self.standing_charge_entity}",
+                                                       headers=self.headers) as response:
+            response.raise_for_status()
+            return self._standing_charge_from_state(await json_codec.decode_async_response(response))
+
+    def _fetch_standing_charge(self) -> float:
+        response = http_client.get(
+            f"{self.ha_url}/states/{self.standing_charge_entity}",
+            headers=self.headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        return self._standing_charge_from_state(json_codec.decode_response(response))
+
+    @staticmethod
+    def _standing_charge_from_state(data: dict) -> float:
+        standing_charge_pounds = float(data['state'])
+
+        # Convert from pounds to pence
+        return standing_charge_pounds * 100
     
     def is_available(self) -> bool:
         """Check if Home Assistant integration is properly configured."""
@@ -65,27 +134,61 @@ class HomeAssistantDataSource(BaseDataSource):
             self.standing_charge_entity
         ])
     
-    def _get_entity_history(self, entity_id: str, start_date: str, end_date: str) -> List[Dict]:
-        """Get historical data for an entity from Home Assistant."""
+    def _get_entities_history(self, entity_ids: List[str], start_date: str, end_date: str) -> Dict[str, List[Dict]]:
+        """Get historical data for several entities from Home Assistant in a single request."""
+        response = self._request_history(entity_ids, start_date, end_date)
+        
+        # HA returns an array per entity (omitting entities without history). With minimal_response
+        # only the first state of each array carries the entity_id.
+        histories = {}
+        for entity_history in json_codec.decode_response(response) or []:
+            if entity_history:
+                histories[entity_history[0]['entity_id']] = entity_history
+        
+        return histories
+
+    def _stream_consumption_data(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """
+        Get consumption data by parsing the history response incrementally and folding each state into
+        half-hour buckets, so memory stays roughly constant however often the sensors update.
+        """
+        buckets = HistoryBuckets()
+        with self._request_history([self.energy_entity, self.rate_entity], start_date, end_date, stream=True) as response:
+            for entity_index, state in iter_history_states(response.iter_content(chunk_size=HISTORY_CHUNK_SIZE)):
+                buckets.add(entity_index, state)
+
+        return self._periods_from_buckets(buckets)
+
+    def _periods_from_buckets(self, buckets: HistoryBuckets) -> List[Dict[str, Any]]:
+        """The 30-minute consumption periods of the streamed energy and rate history."""
+        energy_buckets = buckets.entities.get(self.energy_entity)
+        if energy_buckets is None:
+            return []
+        rate_buckets = buckets.entities.get(self.rate_entity, HalfHourBuckets())
+
+        return self._build_periods(energy_buckets.first_changed, energy_buckets.reading_at, rate_buckets.reading_at)
+
+    def _request_history(self, entity_ids: List[str], start_date: str, end_date: str, stream: bool = False):
+        url, params = self._history_request_args(entity_ids, start_date, end_date)
+        response = http_client.get(url, headers=self.headers, params=params, timeout=60, stream=stream)
+        response.raise_for_status()
+        return response
+
+    def _history_request_args(self, entity_ids: List[str], start_date: str, end_date: str):
+        """Returns the url and query parameters of a history request."""
         # Convert ISO dates to HA format if needed
         start_timestamp = start_date.replace('Z', '+00:00')
         end_timestamp = end_date.replace('Z', '+00:00')
         
         url = f"{self.ha_url}/history/period/{start_timestamp}"
         params = {
-            "filter_entity_id": entity_id,
+            "filter_entity_id": ",".join(entity_ids),
             "end_time": end_timestamp,
-            "minimal_response": "true"
+            # Only the state and last_changed are needed, so trim everything else from the response
+            "minimal_response": "true",
+            "no_attributes": "true"
         }
-        
-        response = requests.get(url, headers=self.headers, params=params, timeout=60)
-        response.raise_for_status()
-        
-        data = response.json()
-        if not data or not data[0]:
-            return []
-        
-        return data[0]  # HA returns array of arrays, we want the first entity's data
+        return url, params
     
     def _process_consumption_data(self, energy_history: List[Dict], rate_history: List[Dict]) -> List[Dict[str, Any]]:
         """Process energy and rate history into 30-minute consumption periods."""
@@ -98,9 +201,26 @@ class HomeAssistantDataSource(BaseDataSource):
         energy_history.sort(key=lambda x: x['last_changed'])
         rate_history.sort(key=lambda x: x['last_changed'])
         
-        # Generate 30-minute intervals for today
         start_time = datetime.fromisoformat(energy_history[0]['last_changed'].replace('Z', '+00:00'))
-        start_time = start_time.replace(minute=0 if start_time.minute < 30 else 30, second=0, microsecond=0)
+        return self._build_periods(
+            start_time,
+            lambda time: self._get_reading_at_time(energy_history, time.isoformat()),
+            lambda time: self._get_reading_at_time(rate_history, time.isoformat())
+        )
+
+    def _build_periods(self, first_reading_time: datetime, energy_at, rate_at) -> List[Dict[str, Any]]:
+        """
+        Build 30-minute consumption periods from the first energy reading until now.
+
+        Args:
+            first_reading_time: Time of the first energy reading
+            energy_at: Callable returning the energy reading at a time
+            rate_at: Callable returning the rate reading at a time
+        """
+        consumption_data = []
+
+        # Generate 30-minute intervals for today
+        start_time = first_reading_time.replace(minute=0 if first_reading_time.minute < 30 else 30, second=0, microsecond=0)
         
         current_time = start_time
         end_time = datetime.now().replace(tzinfo=start_time.tzinfo)
@@ -111,7 +231,7 @@ class HomeAssistantDataSource(BaseDataSource):
             period_end = current_time + timedelta(minutes=30)
             
             # Get energy reading at the end of this period
-            energy_reading = self._get_reading_at_time(energy_history, period_end.isoformat())
+            energy_reading = energy_at(period_end)
             
             if energy_reading is not None and prev_energy is not None:
                 # Calculate consumption delta in Wh
@@ -121,7 +241,7 @@ class HomeAssistantDataSource(BaseDataSource):
                 consumption_delta_wh = consumption_delta_kwh * 1000
                 
                 # Get rate for this period
-                rate_reading = self._get_reading_at_time(rate_history, current_time.isoformat())
+                rate_reading = rate_at(current_time)
                 
                 if rate_reading is not None:
                     rate_pounds_per_kwh = float(rate_reading)
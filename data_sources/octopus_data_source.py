@@ -1,5 +1,6 @@
 from typing import List, Dict, Any
 from .base_data_source import BaseDataSource
+from profiling import profiled_section
 from queries import consumption_query
 import config
 
@@ -12,6 +13,7 @@ class OctopusDataSource(BaseDataSource):
         self.device_id = device_id
         self.current_standing_charge = current_standing_charge
     
+    @profiled_section("OctopusDataSource.get_consumption_data")
     def get_consumption_data(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
         """Get consumption data from Octopus Energy GraphQL API."""
         query = consumption_query.format(
@@ -22,6 +24,24 @@ class OctopusDataSource(BaseDataSource):
         result = self.query_service.execute_gql_query(query)
         return result['smartMeterTelemetry']
     
+    async def get_consumption_data_async(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """Get consumption data from Octopus Energy GraphQL API without blocking the event loop."""
+        # Only an AsyncQueryService can run the query on the event loop
+        if not hasattr(self.query_service, "execute_gql_query_async"):
+            return await super().get_consumption_data_async(start_date, end_date)
+
+        query = consumption_query.format(
+            device_id=self.device_id,
+            start_date=start_date,
+            end_date=end_date
+        )
+        result = await self.query_service.execute_gql_query_async(query)
+        return result['smartMeterTelemetry']
+
+    async def get_standing_charge_async(self) -> float:
+        return self.current_standing_charge
+
+    @profiled_section("OctopusDataSource.get_standing_charge")
     def get_standing_charge(self) -> float:
         """Get the current standing charge from account info."""
         return self.current_standing_charge
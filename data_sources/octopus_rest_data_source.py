@@ -0,0 +1,157 @@
+import asyncio
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Any, Iterator
+import aiohttp
+import http_client
+import json_codec
+from async_query_service import rest_query_async
+import config
+from .base_data_source import BaseDataSource
+from profiling import profiled_section
+
+# Largest page the consumption endpoint allows, roughly 520 days of half-hourly readings
+CONSUMPTION_PAGE_SIZE = 25000
+# Largest page the unit rates endpoint allows
+UNIT_RATES_PAGE_SIZE = 1500
+
+
+class OctopusRestDataSource(BaseDataSource):
+    """
+    Data source that uses the Octopus Energy REST consumption endpoint. Works without an Octopus Home Mini
+    and can backfill months of half-hourly history in a few requests, but readings usually lag by a day.
+    """
+
+    def __init__(self, mpan: str, meter_serial: str, product_code: str, tariff_code: str, current_standing_charge: float):
+        self.mpan = mpan
+        self.meter_serial = meter_serial
+        self.product_code = product_code
+        self.tariff_code = tariff_code
+        self.current_standing_charge = current_standing_charge
+        self.auth = (config.API_KEY, "")
+
+    @profiled_section("OctopusRestDataSource.get_consumption_data")
+    def get_consumption_data(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """Get consumption data from the Octopus Energy REST API, costed with the current tariff's unit rates."""
+        rates = self._get_unit_rates(start_date, end_date)
+        return self._cost_readings(self.iter_consumption(start_date, end_date), rates, start_date, end_date)
+
+    async def get_consumption_data_async(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """Get consumption data from the Octopus Energy REST API, fetching the readings and rates at once."""
+        readings, rates = await asyncio.gather(
+            self._get_pages_async(self._consumption_url(), self._consumption_params(start_date, end_date)),
+            self._get_pages_async(self._unit_rates_url(), self._unit_rates_params(start_date, end_date)))
+        return self._cost_readings(readings, self._sort_unit_rates(rates), start_date, end_date)
+
+    def _cost_readings(self, readings, rates, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        rate_starts = [rate['valid_from'] for rate in rates]
+
+        consumption_data = []
+        unpriced = []
+        for reading in readings:
+            # Intervals are in local time (e.g. +01:00 during BST) but rates and readAt are in UTC
+            read_at = datetime.fromisoformat(reading['interval_start'].replace('Z', '+00:00')) \
+                .astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            consumption_kwh = float(reading['consumption'])
+
+            # Rates are sorted by valid_from, so the matching one is the last that starts at or before the reading
+            rate_index = bisect_right(rate_starts, read_at) - 1
+            rate = rates[rate_index] if rate_index >= 0 else None
+            if rate is None or read_at > (rate.get('valid_to') or "9999-12-31T23:59:59Z"):
+                # Counting it as free would make the current tariff look cheaper than it is
+                unpriced.append(read_at)
+                continue
+
+            consumption_data.append({
+                'readAt': read_at,
+                'consumptionDelta': consumption_kwh * 1000,
+                'costDeltaWithTax': consumption_kwh * rate['value_inc_vat']
+            })
+
+        if unpriced:
+            print(f"Left out {len(unpriced)} REST readings without a unit rate, from {unpriced[0]} to {unpriced[-1]}")
+        if not consumption_data:
+            print(f"No REST consumption data between {start_date} and {end_date}. It is usually published a day later.")
+        return consumption_data
+
+    def comparison_day(self) -> date:
+        """Yesterday, as the readings are usually only published the day after."""
+        return date.today() - timedelta(days=1)
+
+    @profiled_section("OctopusRestDataSource.get_standing_charge")
+    def get_standing_charge(self) -> float:
+        """Get the current standing charge from account info."""
+        return self.current_standing_charge
+
+    async def get_standing_charge_async(self) -> float:
+        return self.current_standing_charge
+
+    def is_available(self) -> bool:
+        """Check if the meter can be queried through the REST API."""
+        return bool(
+            self.mpan and
+            self.meter_serial and
+            self.tariff_code and
+            config.API_KEY
+        )
+
+    def iter_consumption(self, period_from: str, period_to: str) -> Iterator[Dict[str, Any]]:
+        """Stream half-hourly readings oldest first, fetching further pages only as they are needed."""
+        yield from self._iter_pages(self._consumption_url(), self._consumption_params(period_from, period_to))
+
+    def _consumption_url(self) -> str:
+        return f"{config.BASE_URL}/electricity-meter-points/{self.mpan}/meters/{self.meter_serial}/consumption/"
+
+    def _consumption_params(self, period_from: str, period_to: str) -> dict:
+        return {
+            "period_from": period_from,
+            "period_to": period_to,
+            "page_size": CONSUMPTION_PAGE_SIZE,
+            "order_by": "period",
+        }
+
+    def _get_unit_rates(self, period_from: str, period_to: str) -> List[Dict[str, Any]]:
+        return self._sort_unit_rates(self._iter_pages(self._unit_rates_url(),
+                                                      self._unit_rates_params(period_from, period_to)))
+
+    def _unit_rates_url(self) -> str:
+        return f"{config.BASE_URL}/products/{self.product_code}/electricity-tariffs/{self.tariff_code}/standard-unit-rates/"
+
+    def _unit_rates_params(self, period_from: str, period_to: str) -> dict:
+        return {
+            "period_from": period_from,
+            "period_to": period_to,
+            "page_size": UNIT_RATES_PAGE_SIZE,
+        }
+
+    @staticmethod
+    def _sort_unit_rates(rates) -> List[Dict[str, Any]]:
+        rates = [rate for rate in rates
+                 # DIRECT_DEBIT is for flexible that has different price for direct debit or not
+                 if rate.get('payment_method') in [None, "DIRECT_DEBIT"]]
+        return sorted(rates, key=lambda rate: rate['valid_from'])
+
+    def _iter_pages(self, url: str, params: dict) -> Iterator[Dict[str, Any]]:
+        while url:
+            response = http_client.get(url, params=params, auth=self.auth, timeout=60)
+            if not response.ok:
+                raise Exception(f"ERROR: REST query failed querying `{url}` with {response.status_code}")
+
+            page = json_codec.decode_response(response)
+            yield from page.get('results', [])
+
+            # The next link already includes the query parameters
+            url = page.get('next')
+            params = None
+
+    async def _get_pages_async(self, url: str, params: dict) -> List[Dict[str, Any]]:
+        results = []
+        auth = aiohttp.BasicAuth(*self.auth)
+        while url:
+            page = await rest_query_async(url, params=params, auth=auth)
+            results += page.get('results', [])
+
+            # The next link already includes the query parameters
+            url = page.get('next')
+            params = None
+        return results
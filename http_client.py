@@ -0,0 +1,23 @@
+import os
+import requests
+import config
+from cassette import install_cassette
+
+# Shared session for every request to Octopus and Home Assistant, so connections are reused
+# and the whole run can be recorded or replayed (see cassette.py).
+session = requests.Session()
+
+if config.CASSETTE_MODE:
+    # The cassette is mounted on this session only, so the aiohttp requests would go to the network
+    if config.ASYNC_IO:
+        raise Exception("CASSETTE_MODE can't record or replay the requests of ASYNC_IO, turn one of them off")
+    os.makedirs(os.path.dirname(config.CASSETTE_PATH) or ".", exist_ok=True)
+    install_cassette(session, config.CASSETTE_PATH, config.CASSETTE_MODE)
+
+
+def get(url, **kwargs):
+    return session.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return session.post(url, **kwargs)
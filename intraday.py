@@ -0,0 +1,102 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+import config
+import rate_table
+from results import consumption_hash
+
+# The last period is re-fetched on every update because it may have been incomplete last time. Home Assistant
+# only uses the first period of a fetch for its starting meter reading, so the period before it is fetched too.
+OVERLAP = timedelta(minutes=60)
+
+
+def intraday_state_dir() -> str:
+    return os.path.join(config.DATA_DIR, "intraday")
+
+
+class IntradayStore:
+    """
+    Today's consumption and running per-tariff totals for each meter (keyed by MPAN), persisted between
+    runs so that each update only fetches the readings newer than the last one processed. Each meter has its
+    own file, so accounts sharing DATA_DIR don't overwrite each other's.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or intraday_state_dir()
+        # The meters loaded so far, key: MPAN
+        self.meters = {}
+        # Readings that changed in the last fetch, key: MPAN, value: list of (new_reading, previous_reading or None)
+        self.changed = {}
+
+    def meter_path(self, mpan: str) -> str:
+        return os.path.join(self.directory, f"{mpan}.json")
+
+    def meter(self, mpan: str) -> dict:
+        if mpan not in self.meters:
+            try:
+                with open(self.meter_path(mpan)) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = None
+
+            # Running totals are only for today, so forget any previous days
+            if state is None or state.get("date") != str(date.today()):
+                state = {
+                    "date": str(date.today()),
+                    "last_read_at": None,
+                    "consumption_hash": None,
+                    "current_tariff": None,
+                    "readings": {},
+                    "rates": {},
+                    "totals": {},
+                }
+            self.meters[mpan] = state
+        return self.meters[mpan]
+
+    def fetch_consumption(self, data_source, mpan: str):
+        """
+        Fetch the readings since the last update and merge them into today's readings.
+
+        Returns:
+            All of today's readings. The readings that are new or different are recorded in self.changed.
+        """
+        state = self.meter(mpan)
+        if state["last_read_at"]:
+            last_read_at = datetime.fromisoformat(state["last_read_at"].replace('Z', '+00:00'))
+            start_date = (last_read_at - OVERLAP).strftime('%Y-%m-%dT%H:%M:%SZ')
+        else:
+            start_date = f"{date.today()}T00:00:00Z"
+        end_date = f"{date.today()}T23:59:59Z"
+
+        changed = []
+        for reading in data_source.get_consumption_data(start_date, end_date):
+            read_at = reading['readAt'].replace('+00:00', 'Z')
+            # Only the fields used for costing are kept
+            reading = {
+                'readAt': read_at,
+                'consumptionDelta': reading['consumptionDelta'],
+                'costDeltaWithTax': reading.get('costDeltaWithTax'),
+            }
+            previous = state["readings"].get(read_at)
+            if previous != reading:
+                state["readings"][read_at] = reading
+                changed.append((reading, previous))
+
+        if state["readings"]:
+            state["last_read_at"] = max(state["readings"])
+
+        self.changed[mpan] = changed
+        return [state["readings"][read_at] for read_at in sorted(state["readings"])]
+
+    def has_changed(self, mpan: str, consumption) -> bool:
+        """Record the hash of the consumption and return whether it differs from the previous update."""
+        state = self.meter(mpan)
+        new_hash = consumption_hash(consumption)
+        if new_hash == state["consumption_hash"]:
+            return False
+        state["consumption_hash"] = new_hash
+        return True
+
+    def save(self):
+        for mpan, state in self.meters.items():
+            rate_table.save_json(self.meter_path(mpan), state)
@@ -0,0 +1,28 @@
+import json
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Decoding of API responses. Uses orjson when it is installed (several times faster on long telemetry,
+# history and rate payloads) unless JSON_DECODER=json, and always decodes straight from the response bytes
+# instead of going through a decoded str first.
+
+if orjson is not None and config.JSON_DECODER != "json":
+    loads = orjson.loads
+    DECODER = "orjson"
+else:
+    loads = json.loads
+    DECODER = "json"
+
+
+def decode_response(response):
+    """Decode a requests response, like response.json()."""
+    return loads(response.content)
+
+
+async def decode_async_response(response):
+    """Decode an aiohttp response, like response.json()."""
+    return loads(await response.read())
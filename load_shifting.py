@@ -0,0 +1,97 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Length of a consumption period in hours
+PERIOD_HOURS = 0.5
+# SHIFT_WINDOW is in UK time, whatever the container's timezone is
+LONDON = ZoneInfo("Europe/London")
+
+
+def parse_window(window: str):
+    """Parse a "HH:MM-HH:MM" window into a pair of "HH:MM" strings. Empty means the whole day."""
+    if not window:
+        return None
+    start, end = (part.strip() for part in window.split("-"))
+    return start, end
+
+
+def in_window(period_time: str, window) -> bool:
+    if window is None:
+        return True
+
+    # Windows are given in UK time, period times are UTC
+    local_time = datetime.fromisoformat(period_time.replace('Z', '+00:00')).astimezone(LONDON).strftime("%H:%M")
+    start, end = window
+    if start <= end:
+        return start <= local_time < end
+    # The window wraps around midnight e.g. 23:30-05:30
+    return local_time >= start or local_time < end
+
+
+def optimise_load_shift(period_costs, shiftable_kwh: float, max_kw: float, window=None) -> dict:
+    """
+    Move up to `shiftable_kwh` of consumption out of the most expensive periods and into the cheapest
+    periods allowed by the window, without drawing more than `max_kw` of extra load in any period.
+
+    Moving load from the dearest remaining period into the cheapest remaining period, for as long as
+    that is still cheaper, is optimal because every kWh moved is independent of the others.
+
+    Args:
+        period_costs: Output of calculate_potential_costs for a tariff
+        shiftable_kwh: Flexible energy budget in kWh
+        max_kw: Maximum extra power the shifted load can draw in a period
+        window: Parsed window (see parse_window) the load can be moved into
+
+    Returns:
+        {
+            'shifted_kwh': 1.5,   # Energy actually moved
+            'saving': 12.3,       # Consumption cost saved in pence
+            'moves': [{'from': ..., 'to': ..., 'kwh': ...}, ...]
+        }
+    """
+    # Each period is [period_end, rate, kWh available/capacity left]
+    sources = sorted(([p['period_end'], p['rate'], p['consumption_kwh']] for p in period_costs
+                      if p['consumption_kwh'] > 0),
+                     key=lambda p: p[1], reverse=True)
+    max_period_kwh = max_kw * PERIOD_HOURS
+    destinations = sorted(([p['period_end'], p['rate'], max_period_kwh] for p in period_costs
+                           if in_window(p['period_end'], window)),
+                          key=lambda p: p[1])
+
+    remaining = shiftable_kwh
+    saving = 0
+    moves = []
+    source_index = destination_index = 0
+    while remaining > 0 and source_index < len(sources) and destination_index < len(destinations):
+        source = sources[source_index]
+        destination = destinations[destination_index]
+        if source[1] <= destination[1]:
+            break  # Nothing left that is cheaper to move
+
+        kwh = min(remaining, source[2], destination[2])
+        saving += kwh * (source[1] - destination[1])
+        moves.append({'from': source[0], 'to': destination[0], 'kwh': kwh})
+
+        remaining -= kwh
+        source[2] -= kwh
+        destination[2] -= kwh
+        if source[2] <= 0:
+            source_index += 1
+        if destination[2] <= 0:
+            destination_index += 1
+
+    return {
+        'shifted_kwh': shiftable_kwh - remaining,
+        'saving': saving,
+        'moves': moves,
+    }
+
+
+def optimise_load_shift_for_tariffs(period_costs_by_tariff: dict, shiftable_kwh: float, max_kw: float,
+                                    window: str = "") -> dict:
+    """Run optimise_load_shift for every tariff. Returns a dict of tariff -> result."""
+    parsed_window = parse_window(window)
+    return {
+        tariff: optimise_load_shift(period_costs, shiftable_kwh, max_kw, parsed_window)
+        for tariff, period_costs in period_costs_by_tariff.items()
+    }
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Load test of full comparison runs against local stand-ins for the Octopus GraphQL/REST and Home Assistant APIs.
+Runs run_tariff_compare (as a dry run) for many synthetic accounts and reports throughput, latency percentiles,
+request counts and peak memory as JSON, so results can be compared across commits.
+
+Usage:
+    python load_test.py --accounts 1000 --processes 4 --latency 50 --error-rate 0.01 --rate-limit 100 \
+        --output load_test.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from urllib.parse import urlparse, parse_qs
+import config
+from stats import percentile
+
+# key: display name, value: product code
+STUB_PRODUCTS = {
+    "Agile Octopus": "AGILE-24-10-01",
+    "Octopus Go": "GO-VAR-22-10-14",
+    "Cosy Octopus": "COSY-22-12-08",
+    "Flexible Octopus": "VAR-22-11-01",
+}
+REGIONS = "ABCDEFGHJKLMNP"
+HA_ENERGY_ENTITY = "sensor.load_test_energy"
+HA_RATE_ENTITY = "sensor.load_test_rate"
+HA_STANDING_CHARGE_ENTITY = "sensor.load_test_standing_charge"
+# Seconds between the stub energy sensor's updates
+HA_UPDATE_INTERVAL = 300
+
+
+def seeded(*values) -> random.Random:
+    """A random generator that gives the same numbers for the same values, so runs are reproducible."""
+    return random.Random(int(hashlib.sha1("|".join(map(str, values)).encode()).hexdigest()[:12], 16))
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00').replace(' ', '+'))
+
+
+def format_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def half_hours(start: datetime, end: datetime):
+    period = start.replace(minute=start.minute // 30 * 30, second=0, microsecond=0)
+    while period < end:
+        yield period
+        period += timedelta(minutes=30)
+
+
+def unit_rate(product_code: str, period: datetime) -> float:
+    """Pence per kWh of a stub product in a half-hour, shaped roughly like the real tariff."""
+    hour = period.hour + period.minute / 60
+    if product_code.startswith("AGILE"):
+        return round(12 + 20 * (16 <= hour < 19) + seeded(product_code, period).uniform(-8, 8), 2)
+    if product_code.startswith("GO"):
+        return 8.5 if 0.5 <= hour < 5.5 else 27.0
+    if product_code.startswith("COSY"):
+        return 13.0 if 4 <= hour < 7 or 13 <= hour < 16 or hour >= 22 else 29.0
+    return 24.5
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, rate_limit: float):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.tokens = rate_limit
+        self.tokens_at = time.monotonic()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, key: str):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def admit(self) -> int:
+        """Returns the status to fail the request with, or None to serve it."""
+        with self.lock:
+            if self.rate_limit:
+                # Token bucket refilling at rate_limit requests per second
+                now = time.monotonic()
+                self.tokens = min(self.rate_limit, self.tokens + (now - self.tokens_at) * self.rate_limit)
+                self.tokens_at = now
+                if self.tokens < 1:
+                    return 429
+                self.tokens -= 1
+            if self.random.random() < self.error_rate:
+                return 500
+            delay = max(0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.handle_request("home_assistant" if url.path.startswith("/api/") else "rest",
+                            lambda: self.route_get(url.path, parse_qs(url.query)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.handle_request("graphql", lambda: self.route_graphql(json.loads(body)["query"]))
+
+    def handle_request(self, kind: str, route):
+        self.server.count(kind)
+        status = self.server.admit()
+        if status is not None:
+            self.server.count(str(status))
+            return self.reply(status, {"detail": "stub failure"})
+        try:
+            self.reply(200, route())
+        except KeyError:
+            self.server.count("404")
+            self.reply(404, {"detail": "Not found."})
+
+    def reply(self, status: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def route_graphql(self, query: str):
+        if "obtainKrakenToken" in query:
+            return {"data": {"obtainKrakenToken": {"token": "load-test-token"}}}
+        if "smartMeterTelemetry" in query:
+            return {"data": {"smartMeterTelemetry": self.telemetry(
+                re.search(r'deviceId: "([^"]*)"', query).group(1),
+                parse_time(re.search(r'start: "([^"]*)"', query).group(1)),
+                parse_time(re.search(r'end: "([^"]*)"', query).group(1)))}}
+        if "termsAndConditionsForProduct" in query:
+            return {"data": {"termsAndConditionsForProduct": {"name": "Load test", "version": "1.0"}}}
+        if "account(" in query:
+            return {"data": {"account": self.account(re.search(r'accountNumber: "([^"]*)"', query).group(1))}}
+        return {"errors": [{"message": "The load test stub doesn't support this query"}]}
+
+    def account(self, account_number: str):
+        rng = seeded(account_number)
+        region = rng.choice(REGIONS)
+        product_code = rng.choice([STUB_PRODUCTS["Flexible Octopus"], STUB_PRODUCTS["Agile Octopus"]])
+        return {"electricityAgreements": [{
+            "validFrom": "2024-01-01T00:00:00+00:00",
+            "validTo": None,
+            "meterPoint": {
+                "meters": [{"serialNumber": f"S{account_number}", "smartDevices": [{"deviceId": f"D-{account_number}"}]}],
+                "mpan": f"M{account_number}",
+                "direction": "IMPORT",
+            },
+            "tariff": {
+                "id": account_number,
+                "productCode": product_code,
+                "tariffCode": f"E-1R-{product_code}-{region}",
+                "standingCharge": 48.5,
+            },
+        }]}
+
+    def telemetry(self, device_id: str, start: datetime, end: datetime):
+        end = min(end, datetime.now(timezone.utc))
+        readings = []
+        for period in half_hours(start, end):
+            consumption_wh = round(seeded(device_id, period).uniform(50, 900), 1)
+            readings.append({
+                "readAt": format_time(period),
+                "consumptionDelta": consumption_wh,
+                "costDeltaWithTax": round(consumption_wh / 1000 * 24.5, 4),
+            })
+        return readings
+
+    def route_get(self, path: str, params: dict):
+        base_url = self.server.base_url
+        if path == "/v1/products/":
+            return {"count": len(STUB_PRODUCTS), "next": None, "results": [{
+                "code": code,
+                "display_name": name,
+                "direction": "IMPORT",
+                "is_prepay": False,
+                "links": [{"href": f"{base_url}/v1/products/{code}/", "rel": "self"}],
+            } for name, code in STUB_PRODUCTS.items()]}
+
+        match = re.fullmatch(r"/v1/products/([^/]+)/", path)
+        if match and match.group(1) in STUB_PRODUCTS.values():
+            code = match.group(1)
+            return {"code": code, "single_register_electricity_tariffs": {f"_{region}": {"direct_debit_monthly": {
+                "standing_charge_inc_vat": 45 + REGIONS.index(region),
+                "links": [{"rel": "standard_unit_rates",
+                           "href": f"{base_url}/v1/products/{code}/electricity-tariffs/E-1R-{code}-{region}/standard-unit-rates/"}],
+            }} for region in REGIONS}}
+
+        match = re.fullmatch(r"/v1/products/([^/]+)/electricity-tariffs/[^/]+/standard-unit-rates/", path)
+        if match:
+            return {"next": None, "results": self.unit_rates(match.group(1), parse_time(params["period_from"][0]),
+                                                             parse_time(params["period_to"][0]))}
+
+        if path.startswith("/api/history/period/"):
+            return self.ha_history(parse_time(path[len("/api/history/period/"):]), parse_time(params["end_time"][0]))
+        if path == f"/api/states/{HA_STANDING_CHARGE_ENTITY}":
+            return {"entity_id": HA_STANDING_CHARGE_ENTITY, "state": "0.485"}
+        raise KeyError(path)
+
+    def unit_rates(self, product_code: str, start: datetime, end: datetime):
+        if product_code.startswith("VAR"):
+            return [{"value_inc_vat": 24.5, "valid_from": "2024-01-01T00:00:00Z", "valid_to": None,
+                     "payment_method": "DIRECT_DEBIT"}]
+        # Newest first, like the real API
+        return [{"value_inc_vat": unit_rate(product_code, period), "valid_from": format_time(period),
+                 "valid_to": format_time(period + timedelta(minutes=30)), "payment_method": None}
+                for period in reversed(list(half_hours(start, end)))]
+
+    def ha_history(self, start: datetime, end: datetime):
+        end = min(end, datetime.now(timezone.utc))
+        energy, rates = [], []
+        kwh = 1000.0
+        moment = start
+        while moment <= end:
+            kwh += seeded("ha", moment).uniform(0.01, 0.15)
+            energy.append({"state": f"{kwh:.3f}", "last_changed": moment.isoformat()})
+            moment += timedelta(seconds=HA_UPDATE_INTERVAL)
+        for period in half_hours(start, end + timedelta(seconds=1)):
+            rates.append({"state": f"{unit_rate('AGILE', period) / 100:.4f}", "last_changed": period.isoformat()})
+        if energy:
+            energy[0]["entity_id"] = HA_ENERGY_ENTITY
+        if rates:
+            rates[0]["entity_id"] = HA_RATE_ENTITY
+        return [history for history in [energy, rates] if history]
+
+
+def run_accounts(job):
+    """Run a comparison for each account in a worker process. Returns the measurements."""
+    account_numbers, base_url, data_source, async_io, data_dir = job
+    config.BASE_URL = f"{base_url}/v1"
+    config.API_KEY = "load-test"
+    config.DRY_RUN = True
+    config.DATA_DIR = data_dir
+    config.NOTIFICATION_URLS = ""
+    config.BATCH_NOTIFICATIONS = False
+    config.CASSETTE_MODE = ""
+    config.PROFILE_MODE = ""
+    if data_source in ["home_assistant", "hedged"]:
+        config.HA_URL = f"{base_url}/api"
+        config.HA_TOKEN = "load-test"
+        config.HA_ENERGY_ENTITY = HA_ENERGY_ENTITY
+        config.HA_RATE_ENTITY = HA_RATE_ENTITY
+        config.HA_STANDING_CHARGE_ENTITY = HA_STANDING_CHARGE_ENTITY
+    config.DATA_SOURCE_MODE = "hedged" if data_source == "hedged" else "first"
+    config.ASYNC_IO = async_io
+
+    # Imported after configuring so that nothing is set up against the real APIs
+    import aiohttp
+    import async_http_client
+    import http_client
+    import main
+    import results
+
+    request_seconds = []
+    http_client.session.hooks["response"].append(
+        lambda response, *args, **kwargs: request_seconds.append(response.elapsed.total_seconds()))
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        request_seconds.append(time.perf_counter() - context.started)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    async_http_client.TRACE_CONFIGS.append(trace_config)
+
+    run_seconds, decisions = [], {}
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for account_number in account_numbers:
+            config.ACC_NUMBER = account_number
+            # Every account gets its own token, as separate installs would
+            main.query_service_created_at = None
+            started = time.perf_counter()
+            main.run_tariff_compare()
+            run_seconds.append(time.perf_counter() - started)
+            decision = json.loads(results.history_json())[-1]["decision"]
+            decisions[decision] = decisions.get(decision, 0) + 1
+
+    return {
+        "run_seconds": run_seconds,
+        "request_seconds": request_seconds,
+        "decisions": decisions,
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def latency_summary(seconds) -> dict:
+    values = sorted(seconds)
+    if not values:
+        return {}
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p90_ms": round(percentile(values, 90) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1),
+        "mean_ms": round(sum(values) / len(values) * 1000, 1),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test comparison runs against local stub APIs")
+    parser.add_argument("--accounts", type=int, default=1000, help="Number of synthetic accounts")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes running accounts")
+    parser.add_argument("--data-source", choices=["octopus", "home_assistant", "hedged"], default="octopus")
+    parser.add_argument("--async-io", action="store_true", help="Run the comparisons with ASYNC_IO")
+    parser.add_argument("--latency", type=float, default=50, help="Stub response latency in ms")
+    parser.add_argument("--jitter", type=float, default=20, help="Random +/- latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Requests per second before 429s, 0 for none")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    server = StubServer(args.latency, args.jitter, args.error_rate, args.rate_limit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    account_numbers = [f"A-LT{index:06d}" for index in range(args.accounts)]
+    with tempfile.TemporaryDirectory() as data_dir:
+        jobs = [(account_numbers[index::args.processes], server.base_url, args.data_source, args.async_io,
+                 os.path.join(data_dir, str(index))) for index in range(args.processes)]
+        print(f"Running {args.accounts} accounts in {args.processes} processes against {server.base_url}",
+              file=sys.stderr)
+        started = time.perf_counter()
+        with Pool(args.processes) as pool:
+            measurements = pool.map(run_accounts, jobs)
+        elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    decisions = {}
+    for measurement in measurements:
+        for decision, count in measurement["decisions"].items():
+            decisions[decision] = decisions.get(decision, 0) + count
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "duration_s": round(elapsed, 2),
+        "accounts_per_s": round(args.accounts / elapsed, 2),
+        "accounts_per_hour": round(args.accounts / elapsed * 3600),
+        "decisions": decisions,
+        "run_latency": latency_summary(seconds for measurement in measurements
+                                       for seconds in measurement["run_seconds"]),
+        "request_latency": latency_summary(seconds for measurement in measurements
+                                           for seconds in measurement["request_seconds"]),
+        "requests": dict(sorted(server.counts.items())),
+        "peak_rss_kib": max(measurement["peak_rss_kib"] for measurement in measurements),
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
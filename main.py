@@ -1,18 +1,33 @@
+import asyncio
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
-import requests
 import config
 from account_info import AccountInfo
 from notification import send_notification, send_batch_notification
 from queries import *
 from tariff import TARIFFS
-from query_service import QueryService
+from query_service import QueryService, run_rest_steps
+import rate_table
+import tariff_rules
+import results
+from intraday import IntradayStore
+from switch_workflow import SwitchWorkflow, STARTED, SWITCH_REQUESTED, AGREEMENT_ACCEPTED, VERIFIED, UNVERIFIED, FAILED
+from profiling import profiled_run
+from load_shifting import optimise_load_shift_for_tariffs
+import tariff_engine
+from risk_analysis import analyse_risk
 from data_sources.data_source_factory import DataSourceFactory
+from data_sources.hedged_data_source import HEDGED, FALLBACK
 
 query_service: QueryService
+query_service_created_at = None
 tariffs = []
 
+# Kraken tokens expire after an hour, so a prefetched one is only reused for a bit less than that
+TOKEN_REUSE_SECONDS = 50 * 60
+
 # The version of the terms and conditions is required to accept the new tariff
 def get_terms_version(product_code):
     query = get_terms_version_query.format(product_code=product_code)
@@ -21,9 +36,10 @@ def get_terms_version(product_code):
 
     return({'major': int(terms_version[0]), 'minor': int(terms_version[1])})
 
-def accept_new_agreement(product_code, enrolment_id):
-    # get terms and conditions version
-    version = get_terms_version(product_code)
+def accept_new_agreement(product_code, enrolment_id, version=None):
+    # get terms and conditions version, unless it was prefetched
+    if version is None:
+        version = get_terms_version(product_code)
     # accept terms and conditions
     query = accept_terms_query.format(account_number=config.ACC_NUMBER,
                                           enrolment_id=enrolment_id,
@@ -34,10 +50,8 @@ def accept_new_agreement(product_code, enrolment_id):
 
 
 
-def get_acc_info() -> AccountInfo:
-    # Get basic account information from Octopus API (needed for tariff info and MPAN)
-    query = account_query.format(acc_number=config.ACC_NUMBER)
-    result = query_service.execute_gql_query(query)
+def parse_import_agreement(result) -> dict:
+    """Pick out what the comparison needs about the IMPORT meter from the result of account_query."""
     import_agreement = None
     for agreement in result.get("account", {}).get("electricityAgreements", []):
         meter_point = agreement.get("meterPoint", {})
@@ -76,91 +90,97 @@ def get_acc_info() -> AccountInfo:
         if device_id:
             break
     
+    # The meter serial number is needed for the REST consumption data source
+    meter_serial = next((meter.get("serialNumber") for meter in meter_point.get("meters", [])
+                         if meter.get("serialNumber")), None)
+
     matching_tariff = next((tariff for tariff in tariffs if tariff.is_tariff(tariff_code)), None)
     if matching_tariff is None:
         raise Exception(f"ERROR: Found no supported tariff for {tariff_code}")
 
-    # Create appropriate data source and get consumption data
+    return {
+        "current_tariff": matching_tariff,
+        "tariff_code": tariff_code,
+        "product_code": tariff.get("productCode"),
+        "standing_charge": curr_stdn_charge,
+        "region_code": region_code,
+        "mpan": mpan,
+        "device_id": device_id,
+        "meter_serial": meter_serial,
+    }
+
+
+def create_account_data_source(agreement: dict):
+    # Create appropriate data source for the consumption data
     # Note: device_id may be None if using Home Assistant data source
-    data_source = DataSourceFactory.create_data_source(
+    return DataSourceFactory.create_data_source(
         query_service=query_service,
-        device_id=device_id,
-        current_standing_charge=curr_stdn_charge
+        device_id=agreement["device_id"],
+        current_standing_charge=agreement["standing_charge"],
+        mpan=agreement["mpan"],
+        meter_serial=agreement["meter_serial"],
+        product_code=agreement["product_code"],
+        tariff_code=agreement["tariff_code"]
     )
+
+
+def get_acc_info(intraday_store: IntradayStore = None) -> AccountInfo:
+    # Get basic account information from Octopus API (needed for tariff info and MPAN)
+    query = account_query.format(acc_number=config.ACC_NUMBER)
+    agreement = parse_import_agreement(query_service.execute_gql_query(query))
+    mpan = agreement["mpan"]
+    data_source = create_account_data_source(agreement)
+    day = data_source.comparison_day()
     
-    # Get consumption for today
-    start_date = f"{date.today()}T00:00:00Z"
-    end_date = f"{date.today()}T23:59:59Z"
-    consumption = data_source.get_consumption_data(start_date, end_date)
+    if intraday_store is not None and day == date.today():
+        # Only fetch the readings newer than the last update
+        consumption = intraday_store.fetch_consumption(data_source, mpan)
+    else:
+        # Get consumption for today, or the latest day the data source has readings for
+        start_date = f"{day}T00:00:00Z"
+        end_date = f"{day}T23:59:59Z"
+        consumption = data_source.get_consumption_data(start_date, end_date)
     
     # Get standing charge from data source (may be different for HA)
     standing_charge = data_source.get_standing_charge()
 
-    return AccountInfo(matching_tariff, standing_charge, region_code, consumption, mpan)
-
-
-def get_potential_tariff_rates(tariff, region_code):
-    all_products = rest_query(f"{config.BASE_URL}/products/?brand=OCTOPUS_ENERGY&is_business=false")
-    product = next((
-        product for product in all_products['results']
-        if product['display_name'] == tariff
-           and product['direction'] == "IMPORT"
-    ), None)
-
-    product_code = product.get('code')
-
-    if product_code is None:
-        raise ValueError(f"No matching tariff found for {tariff}")
-
-    # Use the self links to navigate to the tariff details
-    product_link = next((
-        item.get('href') for item in product.get('links', [])
-        if item.get('rel', '').lower() == 'self'
-    ), None)
-
-    if not product_link:
-        raise ValueError(f"Self link not found for tariff {product_code}.")
-
-    tariff_details = rest_query(product_link)
-
-    # Get the standing charge including VAT
-    region_code_key = f'_{region_code}'
-    filtered_region = tariff_details.get('single_register_electricity_tariffs', {}).get(region_code_key)
+    return AccountInfo(agreement["current_tariff"], standing_charge, agreement["region_code"], consumption, mpan,
+                       data_source, day)
 
-    if filtered_region is None:
-        raise ValueError(f"Region code not found {region_code_key}.")
 
-    region_tariffs = filtered_region.get('direct_debit_monthly') or filtered_region.get('varying')
-    standing_charge_inc_vat = region_tariffs.get('standing_charge_inc_vat')
+def get_potential_tariff_rates(tariff, region_code, day: date = None):
+    """A tariff's standing charge, unit rates for the day (default today) and product code."""
+    return run_rest_steps(tariff_rates_steps(tariff, region_code, day))
 
-    if standing_charge_inc_vat is None:
-        raise ValueError(f"Standing charge including VAT not found for region {region_code_key}.")
 
-    # Find the link for standard unit rates
-    region_links = region_tariffs.get('links', [])
-    unit_rates_link = next((
-        item.get('href') for item in region_links
-        if item.get('rel', '').lower() == 'standard_unit_rates'
-    ), None)
+def tariff_rates_steps(tariff, region_code, day: date = None):
+    """The REST steps of get_potential_tariff_rates, also run by async_compare (see query_service.run_rest_steps)."""
+    day = day or date.today()
+    # Prefer the shared rate table if the day's has been materialised
+    shared_rates = rate_table.get_rates(tariff, region_code, day)
+    if shared_rates is not None:
+        return shared_rates
 
-    if not unit_rates_link:
-        raise ValueError(f"Standard unit rates link not found for region: {region_code_key}")
+    all_products = yield rate_table.all_products_url()
+    product = rate_table.find_product(all_products, tariff)
 
-    # Get today's rates
-    today = date.today()
-    unit_rates_link_with_time = f"{unit_rates_link}?period_from={today}T00:00:00Z&period_to={today}T23:59:59Z"
-    unit_rates = rest_query(unit_rates_link_with_time)
+    product_code = product.get('code') if product else None
 
-    return standing_charge_inc_vat, unit_rates.get('results', []), product_code
+    if product_code is None:
+        raise ValueError(f"No matching tariff found for {tariff}")
 
+    tariff_details = yield rate_table.product_link(product)
 
-def rest_query(url):
-    response = requests.get(url)
-    if response.ok:
-        data = response.json()
-        return data
+    # Get the standing charge including VAT and the day's rates
+    standing_charge_inc_vat, unit_rates_link = rate_table.get_region_tariff(tariff_details, region_code)
+    if tariff_rules.is_fixed_schedule(tariff):
+        rule = yield from tariff_rules.rule_steps(product_code, region_code, standing_charge_inc_vat, unit_rates_link)
+        unit_rates = tariff_rules.day_unit_rates(rule, day)
     else:
-        raise Exception(f"ERROR: rest_query failed querying `{url}` with {response.status_code}")
+        day_rates = yield rate_table.day_unit_rates_url(unit_rates_link, day)
+        unit_rates = day_rates.get('results', [])
+
+    return standing_charge_inc_vat, unit_rates, product_code
 
 
 def calculate_potential_costs(consumption_data, rate_data):
@@ -186,6 +206,110 @@ def calculate_potential_costs(consumption_data, rate_data):
         })
     return period_costs
 
+def apply_load_shifting(account_info, period_costs, costs):
+    """
+    Replace each tariff's cost with its cost after moving the shiftable load into its cheapest half-hours,
+    so the switch ranking uses the optimised costs. Returns the summary lines.
+    """
+    current_tariff = account_info.current_tariff
+    try:
+        # The current tariff's cost comes from the meter, so its rates are needed separately
+        (_, current_unit_rates, _) = get_potential_tariff_rates(current_tariff.api_display_name, account_info.region_code,
+                                                                account_info.day)
+        period_costs[current_tariff] = calculate_potential_costs(account_info.consumption, current_unit_rates)
+    except Exception as e:
+        # Shifting only the other tariffs' load would make them look cheaper than the current tariff
+        print(f"Error finding prices for current tariff: {current_tariff.id}. {e}")
+        return "\nNo load shifting, the current tariff's prices are unavailable\n"
+
+    results = optimise_load_shift_for_tariffs(period_costs, config.SHIFTABLE_KWH, config.SHIFT_MAX_KW, config.SHIFT_WINDOW)
+
+    summary = f"\nWith up to {config.SHIFTABLE_KWH:.1f} kWh of load shifted:\n"
+    for tariff, result in results.items():
+        if costs.get(tariff) is None:
+            continue
+        costs[tariff] -= result['saving']
+        summary += f"{tariff.display_name}: £{costs[tariff] / 100:.2f} " \
+                   f"(£{result['saving'] / 100:.2f} saved moving {result['shifted_kwh']:.2f} kWh)\n"
+    return summary
+
+
+def compare_catalog(account_info, costs):
+    """Price today's consumption against the whole catalogue. Returns the summary lines."""
+    try:
+        catalog_costs = tariff_engine.price_catalog(account_info.consumption, account_info.region_code,
+                                                    account_info.day)
+    except Exception as e:
+        print(f"Error comparing catalogue products. {e}")
+        return "\nNo costs for catalogue products\n"
+
+    current_cost = costs[account_info.current_tariff]
+    summary = f"\nCheapest of {len(catalog_costs)} catalogue products (comparison only):\n"
+    for product_code, display_name, cost in catalog_costs[:config.CATALOG_SUMMARY_SIZE]:
+        summary += f"{display_name} ({product_code}): £{cost / 100:.2f} ({(current_cost - cost) / 100:+.2f})\n"
+    return summary
+
+
+def run_risk_analysis(account_info):
+    """Simulate the monthly cost of each tariff. Returns (report or None, summary lines)."""
+    try:
+        report = analyse_risk(account_info.data_source, tariffs, account_info.region_code,
+                              config.RISK_HISTORY_DAYS, config.RISK_SCENARIOS)
+    except Exception as e:
+        print(f"Error running risk analysis. {e}")
+        return None, "\nNo risk analysis today\n"
+
+    summary = f"\nSimulated monthly cost ({config.RISK_SCENARIOS} months from the last {config.RISK_HISTORY_DAYS} days):\n"
+    for tariff, stats in sorted(report.items(), key=lambda item: item[1]['mean']):
+        summary += f"{tariff.display_name}: £{stats['mean'] / 100:.2f} ± £{stats['stdev'] / 100:.2f}, " \
+                   f"p95 £{stats['p95'] / 100:.2f}, p99 £{stats['p99'] / 100:.2f}\n"
+    return report, summary
+
+
+def check_risk_settings():
+    """Raise if the risk policy or analysis is on with a RISK_PERCENTILE the risk report doesn't have."""
+    if (config.SWITCH_POLICY == "risk" or config.RISK_ANALYSIS) and config.RISK_PERCENTILE not in config.RISK_PERCENTILES:
+        raise Exception(f"ERROR: RISK_PERCENTILE must be one of {', '.join(map(str, config.RISK_PERCENTILES))}, "
+                        f"not {config.RISK_PERCENTILE}")
+
+
+def should_switch(savings, risk_report, current_tariff, cheapest_tariff):
+    if config.SWITCH_POLICY == "risk" and risk_report is not None \
+            and current_tariff in risk_report and cheapest_tariff in risk_report:
+        # Only switch if today is cheaper and the tariff isn't riskier over a month at the chosen percentile
+        percentile_key = f"p{config.RISK_PERCENTILE}"
+        return savings > 0 and risk_report[cheapest_tariff][percentile_key] <= risk_report[current_tariff][percentile_key]
+
+    # 2p buffer because cba
+    return savings > 2
+
+
+def resolve_terms_prefetches(terms_prefetches: dict, product_code=None):
+    """
+    Take the prefetched terms version of the tariff being switched to and discard the rest.
+
+    Args:
+        terms_prefetches: key: product code, value: Future of get_terms_version
+        product_code: Product being switched to, or None if not switching
+
+    Returns:
+        The terms version, or None if it wasn't prefetched or the prefetch failed
+    """
+    terms_version = None
+    future = terms_prefetches.pop(product_code, None)
+    if future is not None:
+        try:
+            terms_version = future.result()
+        except Exception as e:
+            print(f"Prefetching the terms version of {product_code} failed, fetching it again when needed. {e}")
+
+    if terms_prefetches:
+        print(f"Discarded {len(terms_prefetches)} speculative terms version lookups: {', '.join(terms_prefetches)}")
+    for discarded in terms_prefetches.values():
+        discarded.cancel()
+    return terms_version
+
+
 def switch_tariff(target_product_code, mpan):
     change_date = date.today()
     query = switch_query.format(account_number=config.ACC_NUMBER, mpan=mpan, product_code=target_product_code, change_date=change_date)
@@ -205,13 +329,122 @@ def verify_new_agreement():
     # next_year = valid_from.replace(year=valid_from.year + 1)
     return valid_from == today
 
-def compare_and_switch():
+def get_enrolments():
+    query = enrolment_query.format(acc_number=config.ACC_NUMBER)
+    return query_service.execute_gql_query(query).get('productEnrolments', [])
+
+
+def find_existing_enrolment(product_code):
+    """Find an in-progress enrolment for the product, e.g. one requested just before a restart."""
+    return next((enrolment.get('id') for enrolment in get_enrolments()
+                 if enrolment.get('product', {}).get('code') == product_code
+                 and enrolment.get('status') not in ["FAILED", "CANCELLED", "COMPLETED"]), None)
+
+
+def find_enrolment(enrolment_id):
+    return next((enrolment for enrolment in get_enrolments() if enrolment.get('id') == enrolment_id), None)
+
+
+def terms_accepted(enrolment) -> bool:
+    """Whether the terms of an enrolment have been accepted, going by its status and the status of its steps."""
+    if enrolment.get('status') == "COMPLETED":
+        return True
+    return any('terms' in step.get('displayName', '').lower() and step.get('status') == "COMPLETED"
+               for stage in enrolment.get('stages') or [] for step in stage.get('steps') or [])
+
+
+def run_switch_workflow(workflow: SwitchWorkflow):
+    """Run the remaining steps of a switch, persisting after each one so a restart can resume it."""
+    product_code = workflow.state["product_code"]
+
+    if workflow.stage == STARTED:
+        # If we restarted after requesting the switch but before saving the result, don't request it again
+        enrolment_id = find_existing_enrolment(product_code) if workflow.resumed else None
+        if enrolment_id is None:
+            enrolment_id = switch_tariff(product_code, workflow.state["mpan"])
+        if enrolment_id is None:
+            workflow.advance(FAILED)
+            send_notification("ERROR: couldn't get enrolment ID")
+            return
+        workflow.advance(SWITCH_REQUESTED, enrolment_id=enrolment_id, requested_at=time.time())
+        send_notification("Tariff switch requested successfully.")
+
+    if workflow.stage == SWITCH_REQUESTED and workflow.resumed:
+        # We may have stopped after accepting the terms but before saving it, or the enrolment may have been dropped
+        enrolment = find_enrolment(workflow.state["enrolment_id"])
+        if enrolment is None or enrolment.get('status') in ["FAILED", "CANCELLED"]:
+            workflow.advance(FAILED)
+            send_notification(f"ERROR: enrolment {workflow.state['enrolment_id']} is "
+                              f"{enrolment.get('status').lower() if enrolment else 'no longer listed'}, "
+                              f"not accepting the agreement. Please check your account.")
+            return
+        if terms_accepted(enrolment):
+            workflow.advance(AGREEMENT_ACCEPTED)
+            send_notification("Agreement was already accepted before the restart.")
+
+    if workflow.stage == SWITCH_REQUESTED:
+        # Give octopus some time to generate the agreement
+        time.sleep(workflow.seconds_until_agreement(60))
+        accepted_version = accept_new_agreement(product_code, workflow.state["enrolment_id"],
+                                                workflow.state.get("terms_version"))
+        workflow.advance(AGREEMENT_ACCEPTED, accepted_version=accepted_version)
+        send_notification("Accepted agreement (v.{version}). Switch successful.".format(version=accepted_version))
+
+    if workflow.stage == AGREEMENT_ACCEPTED:
+        verified = verify_new_agreement()
+        if not verified:
+            send_notification("Verification failed, waiting 20 seconds and trying again...")
+            time.sleep(20)
+            verified = verify_new_agreement()  # Retry
+
+            if verified:
+                send_notification("Verified new agreement successfully. Process finished.")
+            else:
+                send_notification(f"Unable to verify new agreement after retry. Please check your account and emails.\n" \
+                 f"https://octopus.energy/dashboard/new/accounts/{config.ACC_NUMBER}/messages")
+        workflow.advance(VERIFIED if verified else UNVERIFIED)
+
+
+def resume_pending_switch() -> bool:
+    """Resume today's switch if a previous run stopped part way through. Returns whether there was one."""
+    workflow = SwitchWorkflow.load_pending()
+    if workflow is None:
+        return False
+
+    send_notification(f"Resuming switch to {workflow.state['tariff_name']} from stage '{workflow.stage}'")
+    run_switch_workflow(workflow)
+    return True
+
+
+def send_comparison_start():
     welcome_message = "DRY RUN: " if config.DRY_RUN else ""
     welcome_message += "Starting comparison of today's costs..."
     send_notification(welcome_message)
 
-    account_info = get_acc_info()
+
+def compare_and_switch(account_info: AccountInfo = None, tariff_rates: dict = None):
+    """
+    Compare today's cost on every tariff and switch to the cheapest.
+
+    Args:
+        account_info: The account info, if it has already been fetched (e.g. by compare_and_switch_async)
+        tariff_rates: The rates of each tariff, if they have already been fetched. key: Tariff, value: the result
+            of get_potential_tariff_rates or the exception it raised
+    """
+    if account_info is None:
+        send_comparison_start()
+
+        if config.PREFETCH_MINUTES or config.INTRADAY_INTERVAL:
+            # Today's earlier readings were already fetched, so only the newest ones are requested. The store
+            # isn't saved so the intraday totals still see these readings as new next time.
+            account_info = get_acc_info(IntradayStore())
+        else:
+            account_info = get_acc_info()
+    if not account_info.consumption:
+        # Only the standing charges would be compared, which could switch on a day with no usage data
+        raise Exception(f"No consumption data for {account_info.day}, skipping the comparison")
     current_tariff = account_info.current_tariff
+    is_today = account_info.day == date.today()
 
     # Total consumption cost
     total_con_cost = sum(float(entry['costDeltaWithTax'] or 0) for entry in account_info.consumption)
@@ -222,7 +455,8 @@ def compare_and_switch():
     total_kwh = total_wh / 1000  # Convert watt-hours to kilowatt-hours
 
     # Print out consumption on current tariff
-    summary = f"Total Consumption today: {total_kwh:.4f} kWh\n"
+    summary = "" if is_today else f"Comparing {account_info.day}, as today's readings aren't published yet\n"
+    summary += f"Total Consumption {'today' if is_today else f'on {account_info.day}'}: {total_kwh:.4f} kWh\n"
     summary += f"Current tariff {current_tariff.display_name}: £{total_curr_cost / 100:.2f} " \
                f"(£{total_con_cost / 100:.2f} con + " \
                f"£{account_info.standing_charge / 100:.2f} s/c)\n"
@@ -230,48 +464,92 @@ def compare_and_switch():
     # Track costs key: Tariff, value: total cost in pence
     # Add current tariff
     costs = {current_tariff: total_curr_cost}
-
-    # Calculate costs of other tariffs
-    for tariff in tariffs:
-        if tariff == current_tariff:
-            continue  # Skip if you're already on that tariff
-
-        try:
-            (potential_std_charge, potential_unit_rates, potential_product_code) = \
-                get_potential_tariff_rates(tariff.api_display_name, account_info.region_code)
-            tariff.product_code = potential_product_code
-            potential_costs = calculate_potential_costs(account_info.consumption, potential_unit_rates)
-
-            total_tariff_consumption_cost = sum(period['calculated_cost'] for period in potential_costs)
-            total_tariff_cost = total_tariff_consumption_cost + potential_std_charge
-
-            costs[tariff] = total_tariff_cost
-            summary += f"Potential cost on {tariff.display_name}: £{total_tariff_cost / 100:.2f} " \
-                       f"(£{total_tariff_consumption_cost / 100:.2f} con + " \
-                       f"£{potential_std_charge / 100:.2f} s/c)\n"
-
-        except Exception as e:
-            print(f"Error finding prices for tariff: {tariff.id}. {e}")
-            summary += f"No cost for {tariff.display_name}\n"
-            costs[tariff] = None
-
-    # Filter the dictionary to only include tariffs where the `switchable` attribute is True
-    switchable_tariffs = {t: cost for t, cost in costs.items() if t.switchable and cost is not None}
-
-    # Find the cheapest tariffs that is in the list and switchable
-    curr_cost = costs.get(current_tariff, float('inf'))
-    cheapest_tariff = min(switchable_tariffs, key=switchable_tariffs.get)
-    cheapest_cost = costs[cheapest_tariff]
+    # Track the per period costs of each tariff for load shifting, key: Tariff, value: period costs
+    period_costs = {}
+    # Tariffs cheaper than the current one are likely to be switched to, so their terms version is fetched
+    # in the background while the rest are priced. key: product code, value: Future
+    terms_prefetches = {}
+    prefetch_executor = ThreadPoolExecutor(max_workers=2)
+
+    # Shut down in finally, so the lookups still queued don't outlive a comparison that fails part way
+    try:
+        # Calculate costs of other tariffs
+        for tariff in tariffs:
+            if tariff == current_tariff:
+                continue  # Skip if you're already on that tariff
+
+            try:
+                if tariff_rates is None:
+                    rates = get_potential_tariff_rates(tariff.api_display_name, account_info.region_code,
+                                                       account_info.day)
+                elif isinstance(tariff_rates[tariff], Exception):
+                    raise tariff_rates[tariff]
+                else:
+                    rates = tariff_rates[tariff]
+                (potential_std_charge, potential_unit_rates, potential_product_code) = rates
+                tariff.product_code = potential_product_code
+                potential_costs = calculate_potential_costs(account_info.consumption, potential_unit_rates)
+
+                total_tariff_consumption_cost = sum(period['calculated_cost'] for period in potential_costs)
+                total_tariff_cost = total_tariff_consumption_cost + potential_std_charge
+
+                costs[tariff] = total_tariff_cost
+                period_costs[tariff] = potential_costs
+                if tariff.switchable and total_tariff_cost < total_curr_cost and not config.DRY_RUN \
+                        and potential_product_code not in terms_prefetches:
+                    terms_prefetches[potential_product_code] = prefetch_executor.submit(get_terms_version,
+                                                                                       potential_product_code)
+                summary += f"Potential cost on {tariff.display_name}: £{total_tariff_cost / 100:.2f} " \
+                           f"(£{total_tariff_consumption_cost / 100:.2f} con + " \
+                           f"£{potential_std_charge / 100:.2f} s/c)\n"
+
+            except Exception as e:
+                print(f"Error finding prices for tariff: {tariff.id}. {e}")
+                summary += f"No cost for {tariff.display_name}\n"
+                costs[tariff] = None
+
+        if config.SHIFTABLE_KWH > 0:
+            summary += apply_load_shifting(account_info, period_costs, costs)
+
+        if config.COMPARE_CATALOG:
+            summary += compare_catalog(account_info, costs)
+
+        # Filter the dictionary to only include tariffs where the `switchable` attribute is True
+        switchable_tariffs = {t: cost for t, cost in costs.items() if t.switchable and cost is not None}
+
+        # Find the cheapest tariffs that is in the list and switchable
+        curr_cost = costs.get(current_tariff, float('inf'))
+        cheapest_tariff = min(switchable_tariffs, key=switchable_tariffs.get)
+        cheapest_cost = costs[cheapest_tariff]
+
+        savings = curr_cost - cheapest_cost
+
+        risk_report = None
+        # The risk policy only needs the simulation when there is a cheaper tariff to decide on
+        if config.RISK_ANALYSIS or (config.SWITCH_POLICY == "risk" and savings > 0):
+            risk_report, risk_summary = run_risk_analysis(account_info)
+            summary += risk_summary
+
+        if cheapest_tariff == current_tariff:
+            decision = "already_cheapest"
+        elif should_switch(savings, risk_report, current_tariff, cheapest_tariff):
+            decision = "dry_run" if config.DRY_RUN else "switch"
+        else:
+            decision = "no_switch"
+        terms_version = resolve_terms_prefetches(terms_prefetches,
+                                                 cheapest_tariff.product_code if decision == "switch" else None)
+    finally:
+        prefetch_executor.shutdown(wait=False, cancel_futures=True)
+    results.record_comparison(account_info, costs, cheapest_tariff, savings, decision)
+    if is_today:
+        results.record_intraday(account_info.consumption, lambda: costs)
 
     if cheapest_tariff == current_tariff:
         send_notification(
             f"{summary}\nYou are already on the cheapest tariff: {cheapest_tariff.display_name} at £{cheapest_cost / 100:.2f}")
         return
 
-    savings = curr_cost - cheapest_cost
-
-    # 2p buffer because cba
-    if savings > 2:
+    if decision in ["switch", "dry_run"]:
         switch_message = f"{summary}\nInitiating Switch to {cheapest_tariff.display_name}"
         send_notification(switch_message)
 
@@ -288,32 +566,137 @@ def compare_and_switch():
             send_notification("ERROR: mpan is missing.")
             return  
         
-        enrolment_id = switch_tariff(cheapest_tariff.product_code, account_info.mpan)
-        if enrolment_id is None:
-            send_notification("ERROR: couldn't get enrolment ID")
-            return
-        else:
-            send_notification("Tariff switch requested successfully.")
-        # Give octopus some time to generate the agreement
-        time.sleep(60)
-        accepted_version = accept_new_agreement(cheapest_tariff.product_code, enrolment_id)
-        send_notification("Accepted agreement (v.{version}). Switch successful.".format(version=accepted_version))
-
-        verified = verify_new_agreement()
-        if not verified:
-            send_notification("Verification failed, waiting 20 seconds and trying again...")
-            time.sleep(20)
-            verified = verify_new_agreement()  # Retry
-            
-            if verified:
-                send_notification("Verified new agreement successfully. Process finished.")
-            else:
-                send_notification(f"Unable to verify new agreement after retry. Please check your account and emails.\n" \
-                 f"https://octopus.energy/dashboard/new/accounts/{config.ACC_NUMBER}/messages")
+        workflow = SwitchWorkflow.start(cheapest_tariff, account_info.mpan, terms_version=terms_version)
+        run_switch_workflow(workflow)
     else:
         send_notification(f"{summary}\nNot switching today.")
 
 
+def update_intraday_totals(intraday_store: IntradayStore, account_info: AccountInfo):
+    """Update each tariff's running consumption cost for today with the readings that changed since the last update."""
+    state = intraday_store.meter(account_info.mpan)
+    changed = intraday_store.changed.get(account_info.mpan, [])
+    current_tariff = account_info.current_tariff
+
+    # Totals are relative to the current tariff, so start again if it has changed (e.g. after a switch)
+    if state["current_tariff"] != current_tariff.id:
+        state["current_tariff"] = current_tariff.id
+        state["totals"] = {}
+
+    for tariff in tariffs:
+        total = state["totals"].get(tariff.id)
+        # Price just the changed readings if there is a running total, otherwise all of today's
+        new_readings = [new for new, _ in changed] if total is not None else account_info.consumption
+        previous_readings = [previous for _, previous in changed if previous is not None] if total is not None else []
+
+        try:
+            if tariff == current_tariff:
+                delta = sum(float(entry['costDeltaWithTax'] or 0) for entry in new_readings) - \
+                        sum(float(entry['costDeltaWithTax'] or 0) for entry in previous_readings)
+            else:
+                if tariff.id not in state["rates"]:
+                    state["rates"][tariff.id] = get_potential_tariff_rates(tariff.api_display_name, account_info.region_code)
+                (_, unit_rates, _) = state["rates"][tariff.id]
+                delta = sum(period['calculated_cost'] for period in calculate_potential_costs(new_readings, unit_rates)) - \
+                        sum(period['calculated_cost'] for period in calculate_potential_costs(previous_readings, unit_rates))
+        except Exception as e:
+            print(f"Error updating intraday cost for tariff: {tariff.id}. {e}")
+            state["totals"].pop(tariff.id, None)
+            continue
+
+        state["totals"][tariff.id] = (total or 0) + delta
+
+    # Key: Tariff, value: cost so far today in pence including the standing charge
+    costs = {}
+    for tariff in tariffs:
+        if tariff.id not in state["totals"]:
+            continue
+        standing_charge = account_info.standing_charge if tariff == current_tariff else state["rates"][tariff.id][0]
+        costs[tariff] = state["totals"][tariff.id] + standing_charge
+    return costs
+
+
+def connect():
+    """Create the query service (and its token), reusing the prefetched one while its token is still valid."""
+    global query_service, query_service_created_at
+    if query_service_created_at is None or time.time() - query_service_created_at > TOKEN_REUSE_SECONDS:
+        query_service = QueryService(config.API_KEY, config.BASE_URL)
+        query_service_created_at = time.time()
+
+
+def run_prefetch():
+    """
+    Fetch everything the comparison needs that is already known before EXECUTION_TIME: the token, today's
+    rate table and catalogue rates, and today's consumption so far. The comparison then only fetches the
+    readings since then.
+    """
+    started = time.time()
+    try:
+        connect()
+        load_tariffs_from_ids(config.TARIFFS)
+
+        intraday_store = IntradayStore()
+        account_info = get_acc_info(intraday_store)
+        # Only this account's region is needed, unless RATE_TABLE_REGIONS asks for more
+        rate_table.refresh_rate_table(tariffs, regions=rate_table.configured_regions() or [account_info.region_code])
+        # The readings of a data source that lags a day can't be kept for the comparison of today's
+        if account_info.day == date.today() and intraday_store.has_changed(account_info.mpan, account_info.consumption):
+            # Keep the intraday totals in step with the readings the store now has
+            costs = update_intraday_totals(intraday_store, account_info)
+            results.record_intraday(account_info.consumption, lambda: costs)
+        intraday_store.save()
+
+        if config.COMPARE_CATALOG:
+            tariff_engine.load_catalog_rates(account_info.region_code)
+
+        print(f"Prefetched {len(account_info.consumption)} readings and today's rates in {time.time() - started:.1f}s")
+    except:
+        # The comparison fetches whatever is missing itself
+        print(traceback.format_exc())
+
+
+def run_intraday_compare():
+    """Incrementally update today's cost on every tariff. Skips everything if there is no new consumption."""
+    try:
+        global query_service
+        query_service = QueryService(config.API_KEY, config.BASE_URL)
+        load_tariffs_from_ids(config.TARIFFS)
+
+        intraday_store = IntradayStore()
+        account_info = get_acc_info(intraday_store)
+        if account_info.day != date.today():
+            print("Intraday: the data source only has readings up to yesterday")
+            return
+        if not intraday_store.has_changed(account_info.mpan, account_info.consumption):
+            print("Intraday: no new consumption since the last update")
+            return
+
+        costs = update_intraday_totals(intraday_store, account_info)
+        intraday_store.save()
+
+        results.record_intraday(account_info.consumption, lambda: costs)
+        print("Intraday: " + ", ".join(f"{tariff.display_name} £{cost / 100:.2f}" for tariff, cost in costs.items()))
+    except:
+        print(traceback.format_exc())
+
+
+def run_pending_switch():
+    """Resume a switch interrupted by a restart, e.g. when the container starts up again mid-switch."""
+    if SwitchWorkflow.load_pending() is None:
+        return
+
+    try:
+        global query_service
+        query_service = QueryService(config.API_KEY, config.BASE_URL)
+        resume_pending_switch()
+    except:
+        results.record_error(traceback.format_exc())
+        send_notification(message=traceback.format_exc(), title="Octobot Error", error=True)
+    finally:
+        if config.BATCH_NOTIFICATIONS:
+            send_batch_notification()
+
+
 def load_tariffs_from_ids(tariff_ids: str):
     global tariffs
 
@@ -336,10 +719,20 @@ def load_tariffs_from_ids(tariff_ids: str):
     tariffs = matched_tariffs
 
 
+def refresh_rate_table():
+    try:
+        load_tariffs_from_ids(config.TARIFFS)
+        path = rate_table.refresh_rate_table(tariffs, regions=rate_table.configured_regions())
+        if path:
+            print(f"Rate table for {date.today()} is available at {path}")
+    except:
+        send_notification(message=traceback.format_exc(), title="Octobot Rate Table Error", error=True)
+
+
+@profiled_run
 def run_tariff_compare():
     try:
-        global query_service
-        query_service = QueryService(config.API_KEY, config.BASE_URL)
+        check_risk_settings()
         load_tariffs_from_ids(config.TARIFFS)
         
         # Log which data source will be used for consumption data
@@ -347,15 +740,30 @@ def run_tariff_compare():
         if data_source_info["selected_source"] == "home_assistant":
             send_notification("Starting up - will use Home Assistant for consumption data")
         elif data_source_info["selected_source"] == "octopus":
-            send_notification("Starting up - will use Octopus Energy API for consumption data")
+            send_notification("Starting up - will use Octopus Energy API for consumption data "
+                              "(Home Mini telemetry, or half-hourly readings without one)")
+        elif data_source_info["selected_source"] in [HEDGED, FALLBACK]:
+            send_notification(f"Starting up - will use {' and '.join(data_source_info['sources'])} for consumption "
+                              f"data ({data_source_info['selected_source']})")
         else:
             send_notification("Starting up - no valid data source configured")
-        
+
+        if config.ASYNC_IO:
+            # Imported here as async_compare builds on this module
+            from async_compare import compare_and_switch_async
+            asyncio.run(compare_and_switch_async())
+            return
+
+        connect()
         if query_service is not None:
+            # Finish an interrupted switch rather than starting a new comparison
+            if resume_pending_switch():
+                return
             compare_and_switch()
         else:
             raise Exception("ERROR: setup_gql has failed")
     except:
+        results.record_error(traceback.format_exc())
         send_notification(message=traceback.format_exc(), title="Octobot Error", error=True)
     finally:
         if config.BATCH_NOTIFICATIONS:
@@ -0,0 +1,136 @@
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+import config
+
+# Opt-in profiling of comparison runs, enabled with PROFILE_MODE (comma-separated):
+#   cprofile    - cProfile stats, readable with pstats or snakeviz
+#   tracemalloc - peak traced memory and the top allocation sites
+#   sample      - sampled call stacks in folded format (flamegraph.pl / speedscope)
+# When PROFILE_MODE is empty the decorators return the original functions, so there is no overhead.
+PROFILE_MODES = {mode.strip().lower() for mode in config.PROFILE_MODE.split(",") if mode.strip()}
+
+# Sections (e.g. data source calls) timed during the current run
+_sections = None
+
+
+class _StackSampler:
+    """Samples the stack of a thread at a fixed interval and counts identical stacks."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def profiled_run(func):
+    """Profile every call of `func` according to PROFILE_MODE, writing one set of dump files per call."""
+    if not PROFILE_MODES:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _sections
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        run_prefix = os.path.join(config.PROFILE_DIR, f"{func.__name__}-{datetime.now():%Y%m%d-%H%M%S}")
+
+        _sections = []
+        profiler = cProfile.Profile() if "cprofile" in PROFILE_MODES else None
+        sampler = _StackSampler(threading.get_ident(), config.PROFILE_SAMPLE_INTERVAL / 1000) \
+            if "sample" in PROFILE_MODES else None
+        if "tracemalloc" in PROFILE_MODES:
+            tracemalloc.start(config.PROFILE_TRACEMALLOC_FRAMES)
+        if sampler:
+            sampler.start()
+        if profiler:
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(f"{run_prefix}.pstats")
+            if sampler:
+                sampler.stop()
+                sampler.write(f"{run_prefix}.folded")
+
+            summary = {"function": func.__name__, "elapsed_seconds": round(elapsed, 4), "sections": _sections}
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                summary["traced_memory_peak_bytes"] = peak
+                with open(f"{run_prefix}.tracemalloc.txt", "w") as f:
+                    f.write(f"Peak traced memory: {peak / 1024:.1f} KiB, at exit: {current / 1024:.1f} KiB\n\n")
+                    for stat in snapshot.statistics("traceback")[:config.PROFILE_TOP_ALLOCATIONS]:
+                        f.write(f"{stat}\n")
+                        for line in stat.traceback.format():
+                            f.write(f"    {line}\n")
+
+            with open(f"{run_prefix}.summary.json", "w") as f:
+                json.dump(summary, f, indent=2)
+            _sections = None
+            print(f"Profile written to {run_prefix}.*")
+
+    return wrapper
+
+
+def profiled_section(name: str):
+    """Time calls of the decorated function within a profiled run (e.g. data source calls)."""
+    def decorator(func):
+        if not PROFILE_MODES:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _sections is None:
+                return func(*args, **kwargs)
+
+            memory_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                section = {"name": name, "elapsed_seconds": round(time.perf_counter() - start, 4)}
+                if memory_before is not None:
+                    section["traced_memory_delta_bytes"] = tracemalloc.get_traced_memory()[0] - memory_before
+                _sections.append(section)
+
+        return wrapper
+
+    return decorator
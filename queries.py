@@ -47,6 +47,7 @@ account_query = """query{{
         validTo
         meterPoint {{
             meters(includeInactive: false) {{
+                serialNumber
                 smartDevices {{
                     deviceId
                 }}
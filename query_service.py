@@ -1,16 +1,19 @@
-import requests
+import http_client
+import json_codec
 from queries import *
 
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Content-Type': 'application/json'
+}
+
 class QueryService:
     def __init__(self, api_key: str, base_url: str):
         self.base_url = base_url
         self.api_key = api_key
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
-            'Accept': 'application/json, text/plain, */*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Content-Type': 'application/json'
-        }
+        self.headers = HEADERS.copy()
         self.graphql_endpoint = f"{self.base_url}/graphql/"
 
         self.token = None
@@ -37,7 +40,7 @@ class QueryService:
             "variables": {}
         }
 
-        response = requests.post(
+        response = http_client.post(
             self.graphql_endpoint,
             headers=headers,
             json=payload,
@@ -47,9 +50,32 @@ class QueryService:
         if not response.ok:
             raise Exception(f"GQL query failed: {response.status_code}: {response.text}")
 
-        result = response.json()
+        result = json_codec.decode_response(response)
 
         if "errors" in result:
             raise Exception(f"GQL errors: {result['errors']}")
 
-        return result.get("data", {})
\ No newline at end of file
+        return result.get("data", {})
+
+
+def rest_query(url):
+    response = http_client.get(url)
+    if response.ok:
+        data = json_codec.decode_response(response)
+        return data
+    else:
+        raise Exception(f"ERROR: rest_query failed querying `{url}` with {response.status_code}")
+
+
+def run_rest_steps(steps):
+    """
+    Run a generator of REST steps with rest_query. The generator yields the url of each request it needs and is
+    sent back the decoded response, so the same steps can run on the event loop (see run_rest_steps_async).
+    Returns what the generator returns.
+    """
+    try:
+        url = next(steps)
+        while True:
+            url = steps.send(rest_query(url))
+    except StopIteration as finished:
+        return finished.value
@@ -0,0 +1,299 @@
+import json
+import os
+import re
+from datetime import date, timedelta
+import config
+from query_service import rest_query
+
+# Unit rates only depend on product and region, so a single table per day can be
+# shared by every account (and every container mounting the same DATA_DIR).
+REGION_CODES = ["A", "B", "C", "D", "E", "F", "G", "H", "J", "K", "L", "M", "N", "P"]
+
+# Cache of the loaded tables, key: path, value: (mtime, table)
+_loaded_tables = {}
+# The daily tables in DATA_DIR, rate_table_<date>.json and catalog_rate_table_<date>_<region>.json
+DAILY_TABLE_NAME = re.compile(r"(?:catalog_)?rate_table_(\d{4}-\d{2}-\d{2})(?:_[A-Z])?\.json")
+
+
+def configured_regions():
+    """The regions in RATE_TABLE_REGIONS, or None if it isn't set."""
+    return [region.strip().upper() for region in config.RATE_TABLE_REGIONS.split(",") if region.strip()] or None
+
+
+def rate_table_path(day: date) -> str:
+    return os.path.join(config.DATA_DIR, f"rate_table_{day}.json")
+
+
+def all_products_url() -> str:
+    return f"{config.BASE_URL}/products/?brand=OCTOPUS_ENERGY&is_business=false"
+
+
+def get_all_products():
+    return rest_query(all_products_url())
+
+
+def find_product(all_products, api_display_name):
+    return next((
+        product for product in all_products['results']
+        if product['display_name'] == api_display_name
+           and product['direction'] == "IMPORT"
+    ), None)
+
+
+def get_product_details(product):
+    return rest_query(product_link(product))
+
+
+def product_link(product) -> str:
+    # Use the self links to navigate to the tariff details
+    link = next((
+        item.get('href') for item in product.get('links', [])
+        if item.get('rel', '').lower() == 'self'
+    ), None)
+
+    if not link:
+        raise ValueError(f"Self link not found for tariff {product.get('code')}.")
+
+    return link
+
+
+def get_region_tariff(tariff_details, region_code):
+    """Returns the standing charge including VAT and the standard unit rates link for a region."""
+    region_code_key = f'_{region_code}'
+    filtered_region = tariff_details.get('single_register_electricity_tariffs', {}).get(region_code_key)
+
+    if filtered_region is None:
+        raise ValueError(f"Region code not found {region_code_key}.")
+
+    region_tariffs = filtered_region.get('direct_debit_monthly') or filtered_region.get('varying')
+    standing_charge_inc_vat = region_tariffs.get('standing_charge_inc_vat')
+
+    if standing_charge_inc_vat is None:
+        raise ValueError(f"Standing charge including VAT not found for region {region_code_key}.")
+
+    # Find the link for standard unit rates
+    region_links = region_tariffs.get('links', [])
+    unit_rates_link = next((
+        item.get('href') for item in region_links
+        if item.get('rel', '').lower() == 'standard_unit_rates'
+    ), None)
+
+    if not unit_rates_link:
+        raise ValueError(f"Standard unit rates link not found for region: {region_code_key}")
+
+    return standing_charge_inc_vat, unit_rates_link
+
+
+def get_day_unit_rates(unit_rates_link, day: date):
+    return rest_query(day_unit_rates_url(unit_rates_link, day)).get('results', [])
+
+
+def day_unit_rates_url(unit_rates_link, day: date) -> str:
+    return f"{unit_rates_link}?period_from={day}T00:00:00Z&period_to={day}T23:59:59Z"
+
+
+def get_unit_rates_between(unit_rates_link, period_from: str, period_to: str):
+    """All the unit rates in a period, following the pagination."""
+    url = f"{unit_rates_link}?period_from={period_from}&period_to={period_to}&page_size=1500"
+    unit_rates = []
+    while url:
+        page = rest_query(url)
+        unit_rates += page.get('results', [])
+        url = page.get('next')
+    return unit_rates
+
+
+def fetch_product_rates(product, day: date, regions) -> dict:
+    """Fetch a product's standing charge and unit rates for a single day in each region it is offered in."""
+    import tariff_rules
+
+    tariff_details = get_product_details(product)
+    fixed_schedule = tariff_rules.is_fixed_schedule(product['display_name'])
+    product_regions = {}
+    for region_code in regions:
+        try:
+            standing_charge, unit_rates_link = get_region_tariff(tariff_details, region_code)
+            if fixed_schedule:
+                rule = tariff_rules.get_rule(product['code'], region_code, standing_charge, unit_rates_link, day)
+                unit_rates = tariff_rules.day_unit_rates(rule, day)
+            else:
+                unit_rates = get_day_unit_rates(unit_rates_link, day)
+        except Exception as e:
+            # rest_query raises a plain Exception, and one region failing shouldn't lose the others
+            print(f"Rate table: skipping {product['code']} in region {region_code}. {e}")
+            continue
+
+        product_regions[region_code] = {
+            "standing_charge": standing_charge,
+            "rates": [[rate['valid_from'], rate.get('valid_to'), rate['value_inc_vat']]
+                      for rate in unit_rates
+                      if rate.get('payment_method') in [None, "DIRECT_DEBIT"]],
+        }
+
+    return {
+        "code": product['code'],
+        "display_name": product['display_name'],
+        "regions": product_regions,
+    }
+
+
+def build_rate_table(tariffs, day: date = None, regions=None) -> dict:
+    """
+    Fetch the unit rates of every tariff for every region for a single day.
+
+    Rates are stored as compact [valid_from, valid_to, value_inc_vat] rows. Rates that
+    are not for direct debit (flexible lists both) are dropped as they are never used.
+    """
+    day = day or date.today()
+    regions = regions or REGION_CODES
+    all_products = get_all_products()
+
+    table = {"date": str(day), "regions": regions, "products": {}}
+    for tariff in tariffs:
+        product = find_product(all_products, tariff.api_display_name)
+        if product is None or product.get('code') is None:
+            print(f"Rate table: no matching product found for {tariff.api_display_name}")
+            continue
+
+        try:
+            table["products"][tariff.api_display_name] = fetch_product_rates(product, day, regions)
+        except Exception as e:
+            print(f"Rate table: skipping {tariff.api_display_name}. {e}")
+
+    return table
+
+
+def save_json(path: str, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial table
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return path
+
+
+def save_rate_table(table: dict):
+    return save_json(rate_table_path(table["date"]), table)
+
+
+def refresh_rate_table(tariffs, day: date = None, regions=None):
+    """
+    Build and save today's rate table unless another process already has.
+    If the saved table is missing some of the regions, they are fetched and added to it.
+    """
+    day = day or date.today()
+    regions = regions or REGION_CODES
+    path = rate_table_path(day)
+    table = load_rate_table(day)
+    # Tables saved before the regions were recorded have every region
+    missing_regions = [region for region in regions if region not in (table or {}).get("regions", REGION_CODES)] \
+        if table is not None else regions
+    if not missing_regions:
+        return path
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    lock_path = f"{path}.lock"
+    try:
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        print(f"Rate table for {day} is already being built by another process")
+        return None
+
+    try:
+        new_table = build_rate_table(tariffs, day, missing_regions)
+        if table is not None:
+            # Copy, as load_json's result is shared with every other reader in this process
+            merged = json.loads(json.dumps(table))
+            merged["regions"] = sorted(set(merged.get("regions", [])) | set(missing_regions))
+            for name, product in new_table["products"].items():
+                merged["products"].setdefault(name, {**product, "regions": {}})["regions"].update(product["regions"])
+            new_table = merged
+        path = save_rate_table(new_table)
+        prune_daily_tables(day)
+        return path
+    finally:
+        os.close(lock_fd)
+        os.remove(lock_path)
+
+
+def table_day(path: str):
+    """The day of a daily table (see DAILY_TABLE_NAME), or None for any other file."""
+    match = DAILY_TABLE_NAME.fullmatch(os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def prune_daily_tables(day: date = None):
+    """Delete the daily tables in DATA_DIR older than RATE_TABLE_KEEP_DAYS days before `day`."""
+    oldest = str((day or date.today()) - timedelta(days=config.RATE_TABLE_KEEP_DAYS - 1))
+    try:
+        names = os.listdir(config.DATA_DIR)
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        if (table_day(name) or oldest) < oldest:
+            try:
+                os.remove(os.path.join(config.DATA_DIR, name))
+            except FileNotFoundError:
+                pass  # Another process pruned it first
+
+
+def load_rate_table(day: date = None):
+    return load_json(rate_table_path(day or date.today()))
+
+
+def load_json(path: str):
+    """Load a table written by save_json, or None if it doesn't exist. Reloads only if the file changed."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _loaded_tables.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path) as f:
+        table = json.load(f)
+    day = table_day(path)
+    if day is not None:
+        # Only the latest day's tables are read again, so forget the older ones
+        for loaded_path in list(_loaded_tables):
+            if (table_day(loaded_path) or day) < day:
+                _loaded_tables.pop(loaded_path, None)
+    _loaded_tables[path] = (mtime, table)
+    return table
+
+
+def get_rates(api_display_name, region_code, day: date = None):
+    """
+    Look up a tariff's rates in the shared rate table.
+
+    Returns:
+        (standing_charge_inc_vat, unit_rates, product_code) in the same shape as the REST API
+        or None if the table doesn't have the tariff/region for that day.
+    """
+    table = load_rate_table(day)
+    if table is None:
+        return None
+
+    product = table["products"].get(api_display_name)
+    if product is None:
+        return None
+
+    region = product["regions"].get(region_code)
+    if region is None:
+        return None
+
+    unit_rates = [{'valid_from': valid_from, 'valid_to': valid_to, 'value_inc_vat': value_inc_vat, 'payment_method': None}
+                  for valid_from, valid_to, value_inc_vat in region["rates"]]
+    return region["standing_charge"], unit_rates, product["code"]
+
+
+if __name__ == "__main__":
+    from tariff import TARIFFS
+
+    requested_ids = set(config.TARIFFS.lower().split(","))
+    print(f"Rate table written to {refresh_rate_table([t for t in TARIFFS if t.id in requested_ids], regions=configured_regions())}")
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+# Results of the comparisons run by this process, kept in memory for the HTTP API.
+# Everything is serialised once when it is recorded so that reads are just a lookup.
+HISTORY_SIZE = 100
+
+_lock = threading.Lock()
+_latest = b"null"
+_intraday = b"null"
+_intraday_hash = None
+_history = deque(maxlen=HISTORY_SIZE)
+_history_json = b"[]"
+
+
+def _serialise(value) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def consumption_hash(consumption) -> str:
+    """Hash of the consumption readings, used to tell whether anything has changed since the last update."""
+    digest = hashlib.sha1()
+    for entry in consumption:
+        digest.update(f"{entry['readAt']}|{entry['consumptionDelta']}|{entry.get('costDeltaWithTax')};".encode())
+    return digest.hexdigest()
+
+
+def _tariff_costs(costs: dict) -> dict:
+    return {tariff.id: (round(cost, 4) if cost is not None else None) for tariff, cost in costs.items()}
+
+
+def _add_to_history(entry: dict):
+    global _history_json
+    _history.append(entry)
+    _history_json = _serialise(list(_history))
+
+
+def record_comparison(account_info, costs: dict, cheapest_tariff, savings: float, decision: str):
+    """Record the outcome of a full comparison run. Costs are in pence, key: Tariff."""
+    global _latest
+    total_kwh = sum(float(entry['consumptionDelta']) for entry in account_info.consumption) / 1000
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        # The day compared, yesterday for data sources whose readings are published a day late
+        "day": str(account_info.day),
+        "consumption_kwh": round(total_kwh, 4),
+        "current_tariff": account_info.current_tariff.id,
+        "cheapest_tariff": cheapest_tariff.id,
+        "savings": round(savings, 4),
+        "decision": decision,
+        "costs": _tariff_costs(costs),
+    }
+    # Which data source won and how long each took, when several were queried
+    data_source_fetch = getattr(account_info.data_source, "last_fetch", None)
+    if data_source_fetch is not None:
+        result["data_source"] = data_source_fetch
+    with _lock:
+        _latest = _serialise(result)
+        _add_to_history(result)
+
+
+def record_error(message: str):
+    with _lock:
+        _add_to_history({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "decision": "error",
+            "error": message,
+        })
+
+
+def record_intraday(consumption, compute_costs):
+    """
+    Update the intraday cost estimates unless the consumption is unchanged since the last update.
+
+    Args:
+        consumption: Today's consumption records so far
+        compute_costs: Callable returning the cost so far in pence of each tariff, key: Tariff.
+            Only called when the consumption has changed.
+
+    Returns:
+        True if the estimates were recomputed
+    """
+    global _intraday, _intraday_hash
+    new_hash = consumption_hash(consumption)
+    if new_hash == _intraday_hash:
+        return False
+
+    estimate = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "last_read_at": max((entry['readAt'] for entry in consumption), default=None),
+        "periods": len(consumption),
+        "consumption_kwh": round(sum(float(entry['consumptionDelta']) for entry in consumption) / 1000, 4),
+        "costs": _tariff_costs(compute_costs()),
+    }
+    with _lock:
+        _intraday = _serialise(estimate)
+        _intraday_hash = new_hash
+    return True
+
+
+def latest_json() -> bytes:
+    return _latest
+
+
+def intraday_json() -> bytes:
+    return _intraday
+
+
+def history_json() -> bytes:
+    return _history_json
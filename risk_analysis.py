@@ -0,0 +1,129 @@
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+from operator import mul
+import rate_table
+import tariff_rules
+from stats import percentile
+from tariff_engine import consumption_vector, rate_vector
+
+# Monte Carlo simulation of the monthly cost on each tariff. Each simulated month is a sequence of days,
+# each pairing a historical day of consumption with a historical day of prices (so a cheap-usage day can
+# meet an Agile price spike). Every day pairing is priced once up front, so a scenario is just a sum of
+# lookups, and every tariff is priced against the same scenarios.
+
+
+def consumption_days(consumption) -> dict:
+    """Group consumption records by (UTC) day, keeping only complete days. Key: date string, value: records."""
+    days = defaultdict(list)
+    for entry in consumption:
+        days[entry['readAt'][:10]].append(entry)
+    return {day: entries for day, entries in days.items() if len(entries) >= 46}
+
+
+def fetch_rate_history(all_products, api_display_name: str, region_code: str, first_day: date, last_day: date):
+    """
+    Returns (standing_charge_inc_vat, {date string: compact rate rows}) for each day in the range.
+    Fixed-schedule tariffs are priced at their current prices on every day, as those are the prices a month on
+    them would cost.
+    """
+    product = rate_table.find_product(all_products, api_display_name)
+    if product is None:
+        raise ValueError(f"No matching tariff found for {api_display_name}")
+
+    standing_charge, unit_rates_link = rate_table.get_region_tariff(rate_table.get_product_details(product), region_code)
+    if tariff_rules.is_fixed_schedule(api_display_name):
+        rule = tariff_rules.get_rule(product['code'], region_code, standing_charge, unit_rates_link)
+        unit_rates = tariff_rules.unit_rates(rule, f"{first_day}T00:00:00Z", f"{last_day + timedelta(days=1)}T00:00:00Z")
+    else:
+        unit_rates = rate_table.get_unit_rates_between(unit_rates_link, f"{first_day}T00:00:00Z",
+                                                       f"{last_day}T23:59:59Z")
+    rates = [[rate['valid_from'], rate.get('valid_to'), rate['value_inc_vat']]
+             for rate in unit_rates
+             if rate.get('payment_method') in [None, "DIRECT_DEBIT"]]
+
+    days = {}
+    day = first_day
+    while day <= last_day:
+        days[str(day)] = rates
+        day += timedelta(days=1)
+    return standing_charge, days
+
+
+def simulate_monthly_costs(usage_days, tariff_rates: dict, scenarios: int, days_per_month: int, seed=None) -> dict:
+    """
+    Args:
+        usage_days: List of consumption vectors (kWh per half-hour) of historical days
+        tariff_rates: key: tariff, value: (standing_charge, list of rate vectors of historical price days)
+        scenarios: Number of simulated months
+        days_per_month: Days in each simulated month
+
+    Returns:
+        key: tariff, value: {'mean', 'stdev', 'variance', 'p5', 'p50', 'p95', 'p99'} monthly cost in pence
+    """
+    price_day_count = min(len(price_days) for _, price_days in tariff_rates.values())
+    pairs = len(usage_days) * price_day_count
+    rng = random.Random(seed)
+    # The same draws are used for every tariff so the comparison is like for like
+    draws = [rng.randrange(pairs) for _ in range(scenarios * days_per_month)]
+
+    report = {}
+    for tariff, (standing_charge, price_days) in tariff_rates.items():
+        # Cost of every (usage day, price day) pairing, flattened so that index = usage * price_day_count + price
+        day_costs = [sum(map(mul, usage, rates)) + standing_charge
+                     for usage in usage_days for rates in price_days[:price_day_count]]
+
+        monthly = sorted(sum(map(day_costs.__getitem__, draws[start:start + days_per_month]))
+                         for start in range(0, len(draws), days_per_month))
+        mean = sum(monthly) / len(monthly)
+        variance = sum((cost - mean) ** 2 for cost in monthly) / len(monthly)
+        report[tariff] = {
+            'mean': mean,
+            'stdev': variance ** 0.5,
+            'variance': variance,
+            'p5': percentile(monthly, 5),
+            'p50': percentile(monthly, 50),
+            'p95': percentile(monthly, 95),
+            'p99': percentile(monthly, 99),
+        }
+    return report
+
+
+def analyse_risk(data_source, tariffs, region_code: str, history_days: int, scenarios: int,
+                 days_per_month: int = 30, seed=None) -> dict:
+    """
+    Resample the last `history_days` of consumption and prices to simulate the monthly cost of each tariff.
+    Returns the report of simulate_monthly_costs.
+    """
+    last_day = date.today() - timedelta(days=1)
+    first_day = last_day - timedelta(days=history_days - 1)
+
+    history = data_source.get_consumption_data(f"{first_day}T00:00:00Z", f"{last_day}T23:59:59Z")
+    usage_days = [consumption_vector(entries) for entries in consumption_days(history).values()]
+    if not usage_days:
+        raise ValueError(f"No complete days of consumption between {first_day} and {last_day}")
+
+    all_products = rate_table.get_all_products()
+    # key: tariff, value: (standing_charge, {date string: rate vector})
+    tariff_price_days = {}
+    for tariff in tariffs:
+        try:
+            standing_charge, day_rates = fetch_rate_history(all_products, tariff.api_display_name, region_code,
+                                                            first_day, last_day)
+        except Exception as e:
+            print(f"Error finding price history for tariff: {tariff.id}. {e}")
+            continue
+
+        tariff_price_days[tariff] = (standing_charge, {day: vector for day, vector in
+                                                       ((day, rate_vector(rates, day)) for day, rates in day_rates.items())
+                                                       if vector is not None})
+
+    # Only use the days with prices for every tariff, so each price day is the same day for all of them
+    common_days = sorted(set.intersection(*(set(days) for _, days in tariff_price_days.values()))) \
+        if tariff_price_days else []
+    if not common_days:
+        raise ValueError(f"No days with prices for every tariff between {first_day} and {last_day}")
+
+    tariff_rates = {tariff: (standing_charge, [days[day] for day in common_days])
+                    for tariff, (standing_charge, days) in tariff_price_days.items()}
+    return simulate_monthly_costs(usage_days, tariff_rates, scenarios, days_per_month, seed)
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import math
+import os
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+import aiohttp
+import async_http_client
+import config
+import http_client
+import rate_table
+
+# Spreads the daily comparisons of every account sharing a DATA_DIR over RUN_SPREAD_WINDOW minutes after
+# EXECUTION_TIME. Each account registers a file in DATA_DIR/run_schedule named by a hash of its account number,
+# and its slot is the rank of that hash, so the slots are evenly spaced and every container plans the same
+# schedule. The whole schedule is shifted by a fraction of a slot taken from the hashes, so that separate
+# deployments (a fleet of one) don't all start at the same time either.
+# After each run the account saves how long it took, how many requests it sent and how many were answered with
+# 429 or 5xx. A run's requests are spread over its run time, so the slots are widened until few enough runs overlap
+# to keep the fleet's request rate under RUN_SPREAD_MAX_REQUEST_RATE, and every 1% of API errors lowers that rate
+# by a further 10% (down to a quarter of it).
+# The runs compare the day's consumption, so the slots are squeezed to finish before 23:59 when EXECUTION_TIME is
+# too close to midnight, even if that goes over the request rate.
+MIN_DELAY = 10  # Seconds after EXECUTION_TIME of the earliest start
+STALE_AFTER = timedelta(days=3)  # Accounts that haven't registered for this long are left out of the schedule
+# Assumed until an account has run
+DEFAULT_RUN_SECONDS = 30
+DEFAULT_REQUESTS_PER_RUN = 15
+LAST_FINISH = "23:59"  # The runs should be done by then, before the day they compare is over
+
+
+class RequestCounter:
+    """Counts the requests sent and the API errors received, through both http_client and async_http_client."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def count(self, status):
+        with self._lock:
+            self.requests += 1
+            if status is None or status == 429 or status >= 500:
+                self.errors += 1
+
+    def install(self):
+        if self._installed:
+            return
+        self._installed = True
+        http_client.session.hooks["response"].append(
+            lambda response, *args, **kwargs: self.count(response.status_code))
+
+        async def on_request_end(session, context, params):
+            self.count(params.response.status)
+
+        async def on_request_exception(session, context, params):
+            self.count(None)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        async_http_client.TRACE_CONFIGS.append(trace_config)
+
+
+request_counter = RequestCounter()
+
+
+def schedule_dir() -> str:
+    return os.path.join(config.DATA_DIR, "run_schedule")
+
+
+def account_key(acc_number: str = None) -> str:
+    acc_number = config.ACC_NUMBER if acc_number is None else acc_number
+    return hashlib.sha256(acc_number.encode()).hexdigest()[:16]
+
+
+def _fraction(text: str) -> float:
+    return int(hashlib.sha256(text.encode()).hexdigest()[:8], 16) / 16 ** 8
+
+
+def register(acc_number: str = None, **stats):
+    """Add the account to the schedule (or keep it there), saving the stats of its last run if given."""
+    key = account_key(acc_number)
+    path = os.path.join(schedule_dir(), f"{key}.json")
+    entry = dict(rate_table.load_json(path) or {})
+    entry.update(stats, key=key, updated=datetime.now().isoformat(timespec="seconds"))
+    rate_table.save_json(path, entry)
+
+
+def load_fleet(now: datetime = None) -> list:
+    """The registered accounts, sorted by key, leaving out the ones that have gone stale."""
+    oldest = ((now or datetime.now()) - STALE_AFTER).isoformat(timespec="seconds")
+    try:
+        names = os.listdir(schedule_dir())
+    except FileNotFoundError:
+        return []
+
+    entries = []
+    for name in names:
+        if name.endswith(".json"):
+            entry = rate_table.load_json(os.path.join(schedule_dir(), name))
+            if entry and entry.get("updated", "") >= oldest:
+                entries.append(entry)
+    return sorted(entries, key=lambda entry: entry["key"])
+
+
+def plan(acc_number: str = None, now: datetime = None) -> dict:
+    """
+    Plan the start of every account's comparison.
+
+    Returns:
+        The schedule, with this account's delay after EXECUTION_TIME in offset_s and every account's in slots
+    """
+    key = account_key(acc_number)
+    entries = load_fleet(now)
+    if key not in (entry["key"] for entry in entries):
+        entries = sorted(entries + [{"key": key}], key=lambda entry: entry["key"])
+    keys = [entry["key"] for entry in entries]
+
+    ran = [entry for entry in entries if entry.get("run_seconds") is not None]
+    run_seconds = statistics.median(entry["run_seconds"] for entry in ran) if ran else DEFAULT_RUN_SECONDS
+    requests_per_run = statistics.median(entry["requests"] for entry in ran) if ran else DEFAULT_REQUESTS_PER_RUN
+    total_requests = sum(entry["requests"] for entry in ran)
+    error_rate = sum(entry["api_errors"] for entry in ran) / total_requests if total_requests else 0.0
+
+    max_request_rate = config.RUN_SPREAD_MAX_REQUEST_RATE * (1 - min(error_rate * 10, 0.75))
+    window = max(config.RUN_SPREAD_WINDOW * 60 - MIN_DELAY, 0)
+    spacing = max(window / len(keys), rate_spacing(run_seconds, requests_per_run, max_request_rate))
+    # Every start is before MIN_DELAY + len(keys) * spacing, so fit that in before the last run has to finish
+    latest_start = max(seconds_until(LAST_FINISH) - run_seconds, MIN_DELAY)
+    cut_at_midnight = MIN_DELAY + len(keys) * spacing > latest_start
+    if cut_at_midnight:
+        spacing = (latest_start - MIN_DELAY) / len(keys)
+    phase = _fraction("".join(keys))
+    offsets = [MIN_DELAY + (index + phase) * spacing for index in range(len(keys))]
+
+    # A run's requests are spread over the run, and runs started within run_seconds of each other overlap
+    concurrent_runs = min(len(keys), math.ceil(run_seconds / spacing)) if run_seconds and spacing else len(keys)
+    peak_request_rate = requests_per_run * concurrent_runs / run_seconds if run_seconds else 0
+    return {
+        "execution_time": config.EXECUTION_TIME,
+        "window_minutes": config.RUN_SPREAD_WINDOW,
+        "accounts": len(keys),
+        "spacing_s": round(spacing, 1),
+        "account": key,
+        "offset_s": round(offsets[keys.index(key)], 1),
+        "last_offset_s": round(offsets[-1], 1),
+        "cut_at_midnight": cut_at_midnight,
+        "observed": {
+            "runs": len(ran),
+            "run_seconds": round(run_seconds, 1),
+            "requests_per_run": requests_per_run,
+            "api_error_rate": round(error_rate, 4),
+        },
+        "max_request_rate": round(max_request_rate, 2),
+        "expected_concurrent_runs": concurrent_runs,
+        "expected_peak_requests_per_s": round(peak_request_rate, 2),
+        "slots": [{"account": slot_key, "offset_s": round(offset, 1)} for slot_key, offset in zip(keys, offsets)],
+    }
+
+
+def rate_spacing(run_seconds: float, requests_per_run: float, max_request_rate: float) -> float:
+    """The shortest spacing between starts that keeps the runs that overlap under max_request_rate."""
+    if max_request_rate <= 0 or not requests_per_run:
+        return 0
+    # Runs started spacing apart overlap ceil(run_seconds / spacing) at a time, each sending
+    # requests_per_run / run_seconds requests per second
+    overlapping_runs = math.floor(max_request_rate * run_seconds / requests_per_run)
+    if overlapping_runs < 1:
+        # Even a run on its own is faster than that, so keep the average under it
+        return requests_per_run / max_request_rate
+    return run_seconds / overlapping_runs
+
+
+def seconds_until(time_of_day: str) -> float:
+    """Seconds from EXECUTION_TIME to a later time (HH:MM) of the same day, 0 if it isn't later."""
+    execution = datetime.strptime(config.EXECUTION_TIME, "%H:%M")
+    return max((datetime.strptime(time_of_day, "%H:%M") - execution).total_seconds(), 0)
+
+
+def describe(schedule: dict) -> str:
+    text = (f"Run schedule: {schedule['accounts']} accounts starting every {schedule['spacing_s']:.0f}s from "
+            f"{schedule['execution_time']}, the last {schedule['last_offset_s'] / 60:.1f} minutes after. "
+            f"Expected peak {schedule['expected_peak_requests_per_s']} requests/s "
+            f"with up to {schedule['expected_concurrent_runs']} comparisons at once.")
+    if schedule['cut_at_midnight']:
+        text += (f" Squeezed to finish before {LAST_FINISH}, as EXECUTION_TIME is too close to midnight for "
+                 f"RUN_SPREAD_WINDOW or {schedule['max_request_rate']} requests/s.")
+    elif schedule['last_offset_s'] > schedule['window_minutes'] * 60:
+        text += f" Spread past RUN_SPREAD_WINDOW to stay under {schedule['max_request_rate']} requests/s."
+    return text
+
+
+def schedule_json() -> bytes:
+    return json.dumps(plan(), separators=(",", ":")).encode()
+
+
+def measure(run):
+    """Call run() and save how long it took and the requests and API errors it caused, for the next plans."""
+    request_counter.install()
+    requests, errors = request_counter.requests, request_counter.errors
+    started = time.monotonic()
+    try:
+        return run()
+    finally:
+        register(run_seconds=round(time.monotonic() - started, 1),
+                 requests=request_counter.requests - requests,
+                 api_errors=request_counter.errors - errors)
@@ -1,30 +1,78 @@
 import time
-from datetime import datetime
-import random
+from datetime import datetime, timedelta
 import config
-from main import run_tariff_compare
+import run_schedule
+from main import run_tariff_compare, refresh_rate_table, run_intraday_compare, run_pending_switch, run_prefetch
 from notification import send_notification
+from api_server import start_api_server
 
 # Track last execution date to ensure we only run once per day
 last_execution_date = None
+last_rate_table_date = None
+last_intraday_run = None
+last_prefetch_date = None
+
+
+def get_prefetch_time():
+    """Time to prefetch the comparison inputs, PREFETCH_MINUTES before the execution time, or None if disabled."""
+    if config.PREFETCH_MINUTES <= 0:
+        return None
+    execution = datetime.strptime(config.EXECUTION_TIME, "%H:%M")
+    prefetch = execution - timedelta(minutes=config.PREFETCH_MINUTES)
+    if prefetch.date() != execution.date():
+        # The prefetch would run on the previous day and fetch a day that is never compared
+        send_notification(message=f"PREFETCH_MINUTES ({config.PREFETCH_MINUTES}) reaches back past midnight from "
+                                  f"EXECUTION_TIME ({config.EXECUTION_TIME}). Prefetching is off.",
+                          title="Octobot Error", error=True)
+        return None
+    return prefetch.strftime("%H:%M")
+
+
+# Prefetch the comparison inputs this long before the execution time
+prefetch_time = get_prefetch_time()
 
 if config.ONE_OFF_RUN:
     send_notification(message=f"Octobot {config.BOT_VERSION} on. Running a one off comparison.")
     run_tariff_compare()
 else:
+    if config.API_PORT:
+        start_api_server()
+
     send_notification(message=f"Welcome to Octobot {config.BOT_VERSION}. I will run your comparisons at {config.EXECUTION_TIME}", batchable=False)
 
+    # Join the run schedule now, so the other accounts sharing DATA_DIR leave a slot for this one
+    run_schedule.register()
+
+    # Finish a switch that was interrupted by a restart
+    run_pending_switch()
+
     while True:
         now = datetime.now()
         current_time = now.strftime("%H:%M")
         current_date = now.date()
 
+        if config.RATE_TABLE_TIME and current_time >= config.RATE_TABLE_TIME and last_rate_table_date != current_date:
+            last_rate_table_date = current_date
+            refresh_rate_table()
+
+        if config.INTRADAY_INTERVAL and (last_intraday_run is None or
+                                         (now - last_intraday_run).total_seconds() >= config.INTRADAY_INTERVAL * 60):
+            last_intraday_run = now
+            run_intraday_compare()
+
+        if prefetch_time and current_time == prefetch_time and last_prefetch_date != current_date:
+            last_prefetch_date = current_date
+            run_prefetch()
+
         if current_time == config.EXECUTION_TIME and last_execution_date != current_date:
             last_execution_date = current_date
-            # 10 Sec - 15 Min Random Delay to prevent all users attempting to access API at same time
-            delay = random.randint(10,900)
+            # Start in this account's slot of the run schedule to prevent all users accessing the API at the same time
+            run_schedule.register()
+            schedule = run_schedule.plan()
+            print(run_schedule.describe(schedule))
+            delay = schedule["offset_s"]
             send_notification(message=f"Octobot {config.BOT_VERSION} on. Initiating comparison in {delay/60:.1f} minutes")
-            delay = time.sleep(delay)
-            run_tariff_compare()
+            time.sleep(delay)
+            run_schedule.measure(run_tariff_compare)
 
         time.sleep(30)  # Check time every 30 seconds
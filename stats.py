@@ -0,0 +1,8 @@
+# Small statistics helpers with no dependencies on the rest of the bot, so tools like load_test.py can use them
+# before they have configured it.
+
+
+def percentile(sorted_values, percent: float) -> float:
+    """The nearest-rank percentile of already sorted values."""
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,86 @@
+import json
+import os
+import time
+from datetime import date
+import config
+
+# Stages of a switch, in order. Each stage is persisted once it has completed so that a restart
+# resumes from the next step instead of repeating requests to Octopus.
+STARTED = "started"
+SWITCH_REQUESTED = "switch_requested"
+AGREEMENT_ACCEPTED = "agreement_accepted"
+VERIFIED = "verified"
+UNVERIFIED = "unverified"
+FAILED = "failed"
+
+FINISHED_STAGES = [VERIFIED, UNVERIFIED, FAILED]
+
+
+def switch_state_path() -> str:
+    # One file per account, as several accounts can share DATA_DIR
+    return os.path.join(config.DATA_DIR, f"switch_state_{config.ACC_NUMBER}.json")
+
+
+class SwitchWorkflow:
+    """Persisted state of a tariff switch: switch_tariff -> wait -> accept_new_agreement -> verify_new_agreement."""
+
+    def __init__(self, state: dict, path: str = None, resumed: bool = False):
+        self.state = state
+        self.path = path or switch_state_path()
+        self.resumed = resumed  # Whether this was loaded after a restart
+
+    @classmethod
+    def start(cls, tariff, mpan: str, path: str = None, terms_version: dict = None):
+        """Start a switch. terms_version is the tariff's terms and conditions version if already known."""
+        workflow = cls({
+            "date": str(date.today()),
+            "account_number": config.ACC_NUMBER,
+            "mpan": mpan,
+            "tariff_id": tariff.id,
+            "tariff_name": tariff.display_name,
+            "product_code": tariff.product_code,
+            "stage": STARTED,
+            "enrolment_id": None,
+            "requested_at": None,
+            "terms_version": terms_version,
+            "accepted_version": None,
+        }, path)
+        workflow.save()
+        return workflow
+
+    @classmethod
+    def load_pending(cls, path: str = None):
+        """Return today's unfinished switch for this account, or None."""
+        path = path or switch_state_path()
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # A switch only takes effect from the start of the day it was requested, so older ones can't be resumed
+        if state.get("date") != str(date.today()) or state.get("account_number") != config.ACC_NUMBER:
+            return None
+        if state.get("stage") in FINISHED_STAGES:
+            return None
+        return cls(state, path, resumed=True)
+
+    @property
+    def stage(self) -> str:
+        return self.state["stage"]
+
+    def advance(self, stage: str, **values):
+        self.state.update(values)
+        self.state["stage"] = stage
+        self.save()
+
+    def seconds_until_agreement(self, wait_seconds: float) -> float:
+        """Seconds left of the wait for Octopus to generate the agreement after requesting the switch."""
+        return max(0, self.state["requested_at"] + wait_seconds - time.time())
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -3,7 +3,7 @@ import re
 class Tariff:
     def __init__(self,
                  id: str, display_name: str, api_display_name: str, tariff_code_matcher: str,
-                 url_tariff_name: str, switchable: bool, product_code: str = None):
+                 url_tariff_name: str, switchable: bool, product_code: str = None, fixed_schedule: bool = False):
         self.id = id  # Represents the unique identifier for the tariff.
         self.display_name = display_name  # The user-friendly name of the tariff for display purposes.
         self.api_display_name = api_display_name  # The name used for API interactions with the tariff.
@@ -11,6 +11,7 @@ class Tariff:
         self.url_tariff_name = url_tariff_name  # The tariff name formatted for use in URLs.
         self.switchable = switchable  # Whether this tariff can be switched to or not
         self.product_code = product_code # Product code used in API e.g. "GO-VAR-22-10-14"
+        self.fixed_schedule = fixed_schedule # Same prices in the same windows every day, see tariff_rules.py
 
     def is_tariff(self, current_tariff_name: str) -> bool:
         """Check if the given tariff name matches the tariff code matcher using regex."""
@@ -26,12 +27,12 @@ class Tariff:
         return hash(self.id)
 
     def __str__(self):
-        return f"Tariff(id={self.id}, display_name={self.display_name}, api_display_name={self.api_display_name}, tariff_code_matcher={self.tariff_code_matcher}, url_tariff_name={self.url_tariff_name}, switchable={self.switchable}, product_code={self.product_code})"
+        return f"Tariff(id={self.id}, display_name={self.display_name}, api_display_name={self.api_display_name}, tariff_code_matcher={self.tariff_code_matcher}, url_tariff_name={self.url_tariff_name}, switchable={self.switchable}, product_code={self.product_code}, fixed_schedule={self.fixed_schedule})"
 
 
 TARIFFS = [
-    Tariff("go", "Octopus Go", "Octopus Go", r"-go-", "go", True), # Octopus Go
+    Tariff("go", "Octopus Go", "Octopus Go", r"-go-", "go", True, fixed_schedule=True), # Octopus Go
     Tariff("agile", "Agile Octopus", "Agile Octopus", r"-agile-", "agile", True), # Octopus Agile
-    Tariff("cosy", "Cosy Octopus", "Cosy Octopus", r"-cosy-", r"cosy-octopus", True), # Octopus Cosy
-    Tariff("flexible", "Flexible Octopus", "Flexible Octopus", r"(?<!go-)var", "", False) # Flexible Octopus
+    Tariff("cosy", "Cosy Octopus", "Cosy Octopus", r"-cosy-", r"cosy-octopus", True, fixed_schedule=True), # Octopus Cosy
+    Tariff("flexible", "Flexible Octopus", "Flexible Octopus", r"(?<!go-)var", "", False, fixed_schedule=True) # Flexible Octopus
 ]
@@ -0,0 +1,132 @@
+import os
+import re
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from operator import mul
+import config
+import rate_table
+from query_service import rest_query
+
+# Prices today's consumption against every relevant import product in the Octopus catalogue.
+# Rates are downloaded concurrently once per day and region and cached in DATA_DIR, and all products
+# are then priced at once as a (products x half-hours) rate matrix times the consumption vector.
+PERIODS_PER_DAY = 48
+
+
+def catalog_rate_table_path(day: date, region_code: str) -> str:
+    return os.path.join(config.DATA_DIR, f"catalog_rate_table_{day}_{region_code}.json")
+
+
+def discover_candidates(pattern: str = None, available_at=None):
+    """
+    Find the import products in the catalogue whose code or display name matches the pattern.
+
+    Args:
+        pattern: Regex matched case-insensitively, e.g. "agile|go|tracker"
+        available_at: Extra dates (YYYY-MM-DD) to look up the catalogue at, to include historic versions
+    """
+    matcher = re.compile(pattern or config.CATALOG_PRODUCTS, re.IGNORECASE)
+    catalog_urls = [f"{config.BASE_URL}/products/?brand=OCTOPUS_ENERGY&is_business=false"]
+    catalog_urls += [f"{catalog_urls[0]}&available_at={day}T00:00:00Z" for day in (available_at or []) if day]
+
+    candidates = {}
+    for url in catalog_urls:
+        while url:
+            page = rest_query(url)
+            for product in page.get('results', []):
+                if product.get('direction') == "IMPORT" and not product.get('is_prepay') \
+                        and (matcher.search(product['code']) or matcher.search(product['display_name'])):
+                    candidates[product['code']] = product
+            url = page.get('next')
+
+    return list(candidates.values())
+
+
+def load_catalog_rates(region_code: str, day: date = None) -> dict:
+    """Load the rates of every candidate product for a region, from the day's cache if it has been built."""
+    day = day or date.today()
+    path = catalog_rate_table_path(day, region_code)
+    table = rate_table.load_json(path)
+    if table is not None:
+        return table
+
+    candidates = discover_candidates(available_at=config.CATALOG_AVAILABLE_AT.split(","))
+    with ThreadPoolExecutor(max_workers=config.CATALOG_FETCH_WORKERS) as executor:
+        products = list(executor.map(lambda product: fetch_candidate_rates(product, day, region_code), candidates))
+
+    table = {
+        "date": str(day),
+        "region": region_code,
+        "products": {product["code"]: product for product in products
+                     if product is not None and region_code in product["regions"]},
+    }
+    rate_table.save_json(path, table)
+    rate_table.prune_daily_tables(day)
+    return table
+
+
+def fetch_candidate_rates(product, day: date, region_code: str):
+    """A candidate's rates for the region, or None if they couldn't be fetched, so one product can't fail the rest."""
+    try:
+        return rate_table.fetch_product_rates(product, day, [region_code])
+    except Exception as e:
+        print(f"Catalogue: skipping {product.get('code')}. {e}")
+        return None
+
+
+def period_index(read_at: str) -> int:
+    read_time = datetime.fromisoformat(read_at.replace('Z', '+00:00'))
+    return (read_time.hour * 60 + read_time.minute) // 30
+
+
+def consumption_vector(consumption) -> list:
+    """Today's consumption in kWh per half-hour, indexed by period of the (UTC) day."""
+    vector = [0.0] * PERIODS_PER_DAY
+    for entry in consumption:
+        vector[period_index(entry['readAt'])] += float(entry['consumptionDelta']) / 1000
+    return vector
+
+
+def rate_vector(rates, day: date) -> list:
+    """A product's unit rate for each half-hour of the day, from compact [valid_from, valid_to, value] rows."""
+    rates = sorted(rates, key=lambda rate: rate[0])
+    rate_starts = [rate[0] for rate in rates]
+
+    vector = []
+    for index in range(PERIODS_PER_DAY):
+        period_start = f"{day}T{index // 2:02d}:{index % 2 * 30:02d}:00Z"
+        rate_index = bisect_right(rate_starts, period_start) - 1
+        if rate_index < 0 or period_start >= (rates[rate_index][1] or "9999-12-31T23:59:59Z"):
+            return None  # Incomplete rates can't be compared fairly
+        vector.append(rates[rate_index][2])
+    return vector
+
+
+def price_catalog(consumption, region_code: str, day: date = None):
+    """
+    Price today's consumption against every candidate product.
+
+    Returns:
+        List of (product_code, display_name, total_cost_in_pence) sorted cheapest first
+    """
+    day = day or date.today()
+    table = load_catalog_rates(region_code, day)
+
+    codes, names, standing_charges, rate_matrix = [], [], [], []
+    for code, product in table["products"].items():
+        region = product["regions"][region_code]
+        rates = rate_vector(region["rates"], day)
+        if rates is None:
+            continue
+        codes.append(code)
+        names.append(product["display_name"])
+        standing_charges.append(region["standing_charge"])
+        rate_matrix.append(rates)
+
+    usage = consumption_vector(consumption)
+    consumption_costs = [sum(map(mul, rates, usage)) for rates in rate_matrix]
+
+    return sorted(zip(codes, names, (cost + standing_charge
+                                     for cost, standing_charge in zip(consumption_costs, standing_charges))),
+                  key=lambda product: product[2])
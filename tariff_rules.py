@@ -0,0 +1,173 @@
+import os
+import threading
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+import config
+import rate_table
+from query_service import run_rest_steps
+from tariff import TARIFFS
+
+# Go, Cosy and Flexible charge the same prices in the same (UK local time) windows every day, so instead of
+# downloading their half-hourly rates for every day, each product version's windows are derived once from a
+# day of its rates, cached in DATA_DIR and used to generate the rates for any period.
+# A rule is derived again when the product code or the region's standing charge changes, and at least daily, as
+# variable products (e.g. Go and Flexible) can change their unit rates without either changing.
+LONDON = ZoneInfo("Europe/London")
+RULE_MAX_AGE = timedelta(days=1)
+HALF_HOUR = timedelta(minutes=30)
+# The catalogue derives rules from several threads at once
+_save_lock = threading.Lock()
+
+
+def rules_path() -> str:
+    return os.path.join(config.DATA_DIR, "tariff_rules.json")
+
+
+def is_fixed_schedule(api_display_name: str) -> bool:
+    return config.TARIFF_RULES and any(tariff.fixed_schedule and tariff.api_display_name == api_display_name
+                                       for tariff in TARIFFS)
+
+
+def format_time(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_time(timestamp: str) -> datetime:
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+
+def local_day_bounds(day: date):
+    """The UTC start and end of a UK day."""
+    return (datetime.combine(day, time(), LONDON).astimezone(timezone.utc),
+            datetime.combine(day + timedelta(days=1), time(), LONDON).astimezone(timezone.utc))
+
+
+def reference_day(day: date = None) -> date:
+    """The latest UK day on or before `day` without a clock change, so it has all 48 half-hours."""
+    day = day or datetime.now(LONDON).date()
+    while True:
+        start, end = local_day_bounds(day)
+        if end - start == timedelta(days=1):
+            return day
+        day -= timedelta(days=1)
+
+
+def reference_rates_url(unit_rates_link, day: date) -> str:
+    start, end = local_day_bounds(day)
+    return f"{unit_rates_link}?period_from={format_time(start)}&period_to={format_time(end)}"
+
+
+def derive_rule(product_code: str, region_code: str, standing_charge, unit_rates, day: date) -> dict:
+    """
+    Derive a product's daily windows from its unit rates for a UK day (see reference_day).
+
+    Returns:
+        The rule, with windows of {'start': local HH:MM, 'value_inc_vat'} each lasting until the next one starts
+    """
+    rates = sorted((rate for rate in unit_rates
+                    # DIRECT_DEBIT is for flexible that has different price for direct debit or not
+                    if rate.get('payment_method') in [None, "DIRECT_DEBIT"]),
+                   key=lambda rate: rate['valid_from'])
+    rate_starts = [rate['valid_from'] for rate in rates]
+
+    windows = []
+    moment, end = local_day_bounds(day)
+    while moment < end:
+        period_start = format_time(moment)
+        rate_index = bisect_right(rate_starts, period_start) - 1
+        if rate_index < 0 or period_start >= (rates[rate_index].get('valid_to') or "9999-12-31T23:59:59Z"):
+            raise ValueError(f"No unit rate for {product_code} in region {region_code} at {period_start}")
+
+        value = rates[rate_index]['value_inc_vat']
+        if not windows or windows[-1]['value_inc_vat'] != value:
+            windows.append({'start': moment.astimezone(LONDON).strftime('%H:%M'), 'value_inc_vat': value})
+        moment += HALF_HOUR
+
+    return {
+        "product_code": product_code,
+        "region": region_code,
+        "standing_charge": standing_charge,
+        "derived_from": str(day),
+        "derived_at": format_time(datetime.now(timezone.utc)),
+        "windows": windows,
+    }
+
+
+def load_rule(product_code: str, region_code: str):
+    return (rate_table.load_json(rules_path()) or {}).get(product_code, {}).get(region_code)
+
+
+def cached_rule(product_code: str, region_code: str, standing_charge, now: datetime = None):
+    """
+    The cached rule, or None if there isn't one, the standing charge has changed since it was derived or it is
+    older than RULE_MAX_AGE.
+    """
+    rule = load_rule(product_code, region_code)
+    if rule is None or rule["standing_charge"] != standing_charge:
+        return None
+    # Rules cached before derived_at was recorded are treated as expired
+    derived_at = rule.get("derived_at")
+    if derived_at is None or (now or datetime.now(timezone.utc)) - parse_time(derived_at) >= RULE_MAX_AGE:
+        return None
+    return rule
+
+
+def save_rule(rule: dict):
+    with _save_lock:
+        # Copy, as load_json's result is shared with every other reader in this process
+        rules = dict(rate_table.load_json(rules_path()) or {})
+        rules[rule["product_code"]] = {**rules.get(rule["product_code"], {}), rule["region"]: rule}
+        rate_table.save_json(rules_path(), rules)
+
+
+def get_rule(product_code: str, region_code: str, standing_charge, unit_rates_link, day: date = None) -> dict:
+    """The product's rule for a region, deriving it from a day of its rates if it isn't cached."""
+    return run_rest_steps(rule_steps(product_code, region_code, standing_charge, unit_rates_link, day))
+
+
+def rule_steps(product_code: str, region_code: str, standing_charge, unit_rates_link, day: date = None):
+    """The REST steps of get_rule (see query_service.run_rest_steps)."""
+    rule = cached_rule(product_code, region_code, standing_charge)
+    if rule is None:
+        day = reference_day(day)
+        reference_rates = yield reference_rates_url(unit_rates_link, day)
+        rule = derive_rule(product_code, region_code, standing_charge, reference_rates.get('results', []), day)
+        save_rule(rule)
+        print(f"Derived the daily rates of {product_code} in region {region_code}")
+    return rule
+
+
+def unit_rates(rule: dict, period_from: str, period_to: str) -> list:
+    """
+    Generate the unit rates from period_from up to period_to, in the same shape and order (newest first) as the
+    REST API. Half-hours in a row with the same price are merged into one rate.
+    """
+    window_starts = [window['start'] for window in rule["windows"]]
+
+    moment = parse_time(period_from)
+    moment = moment.replace(minute=moment.minute // 30 * 30, second=0, microsecond=0)
+    end = parse_time(period_to)
+
+    rates = []
+    while moment < end:
+        # UK clock changes are whole hours, so every UTC half-hour is a local half-hour
+        local_start = moment.astimezone(LONDON).strftime('%H:%M')
+        value = rule["windows"][bisect_right(window_starts, local_start) - 1]['value_inc_vat']
+        valid_to = format_time(moment + HALF_HOUR)
+        if rates and rates[-1]['value_inc_vat'] == value:
+            rates[-1]['valid_to'] = valid_to
+        else:
+            rates.append({'valid_from': format_time(moment), 'valid_to': valid_to, 'value_inc_vat': value,
+                          'payment_method': None})
+        moment += HALF_HOUR
+
+    # calculate_potential_costs takes the first rate whose range includes a reading, so a reading on a boundary
+    # has to find the later rate first
+    rates.reverse()
+    return rates
+
+
+def day_unit_rates(rule: dict, day: date) -> list:
+    """The unit rates for a (UTC) day, as rate_table.get_day_unit_rates."""
+    return unit_rates(rule, f"{day}T00:00:00Z", f"{day + timedelta(days=1)}T00:00:00Z")
@@ -0,0 +1,34 @@
+import gzip
+import json
+import requests
+from cassette import REPLAY, exchange_key, install_cassette
+
+HISTORY_URL = "http://homeassistant.local/api/history/period/2024-01-01T00:00:00+00:00"
+HISTORY_BODY = json.dumps([[{"entity_id": "sensor.energy", "state": "1.5", "last_changed": "2024-01-01T00:00:00+00:00"}]])
+
+
+def write_cassette(path, url, body):
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({"key": exchange_key("GET", url, None), "method": "GET", "url": url, "status": 200,
+                            "reason": "OK", "content_type": "application/json", "body": body}) + "\n")
+
+
+def test_replay_streamed_response(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    write_cassette(path, HISTORY_URL, HISTORY_BODY)
+    session = requests.Session()
+    install_cassette(session, path, REPLAY)
+
+    response = session.get(HISTORY_URL, stream=True)
+
+    assert b"".join(response.iter_content(chunk_size=16)) == HISTORY_BODY.encode()
+    assert response.json()[0][0]["state"] == "1.5"
+
+
+def test_replay_ignores_dates(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    write_cassette(path, HISTORY_URL, HISTORY_BODY)
+    session = requests.Session()
+    install_cassette(session, path, REPLAY)
+
+    assert session.get(HISTORY_URL.replace("2024-01-01", "2024-02-03")).content == HISTORY_BODY.encode()
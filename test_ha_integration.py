@@ -114,6 +114,8 @@ def test_data_source_factory():
             print("  ✅ Factory will use Home Assistant data source")
         elif info['selected_source'] == 'octopus':
             print("  ✅ Factory will use Octopus data source")
+        elif info['selected_source'] in ['hedged', 'fallback']:
+            print(f"  ✅ Factory will use {', '.join(info['sources'])} ({info['selected_source']})")
         else:
             print("  ❌ No valid data source available")
             return False
@@ -0,0 +1,84 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+import requests
+import config
+import http_client
+import data_sources.home_assistant_data_source as ha_module
+from data_sources.home_assistant_data_source import HomeAssistantDataSource
+from intraday import IntradayStore
+
+ENERGY_ENTITY = "sensor.test_energy"
+RATE_ENTITY = "sensor.test_rate"
+
+
+class FakeHomeAssistant:
+    """Serves the history of an energy sensor rising 10 Wh a minute since midnight, up to `now`."""
+
+    def __init__(self):
+        self.midnight = datetime.combine(date.today(), datetime.min.time(), timezone.utc)
+        self.now = self.midnight
+
+    def state_at(self, moment: datetime):
+        minutes = int((moment - self.midnight).total_seconds() // 60)
+        return {"state": f"{minutes * 0.01:.2f}", "last_changed": moment.isoformat()}
+
+    def get(self, url, params=None, **kwargs):
+        start = datetime.fromisoformat(url.rsplit("/", 1)[1])
+        # Like Home Assistant, the first state is the one in effect at the start time
+        energy = [self.state_at(start)]
+        moment = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        while moment <= self.now:
+            energy.append(self.state_at(moment))
+            moment += timedelta(minutes=1)
+        rate = [{"state": "0.25", "last_changed": start.isoformat()}]
+        energy[0]["entity_id"] = ENERGY_ENTITY
+        rate[0]["entity_id"] = RATE_ENTITY
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps([energy, rate]).encode()
+        response._content_consumed = True
+        return response
+
+
+def freeze_now(moment: datetime):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return moment.replace(tzinfo=None) if tz is None else moment.astimezone(tz)
+    ha_module.datetime = FrozenDatetime
+
+
+def test_incremental_fetches_match_a_full_fetch(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "HA_TOKEN", "test")
+    monkeypatch.setattr(config, "HA_ENERGY_ENTITY", ENERGY_ENTITY)
+    monkeypatch.setattr(config, "HA_RATE_ENTITY", RATE_ENTITY)
+    monkeypatch.setattr(config, "HA_STANDING_CHARGE_ENTITY", "sensor.test_standing_charge")
+    home_assistant = FakeHomeAssistant()
+    monkeypatch.setattr(http_client, "get", home_assistant.get)
+    monkeypatch.setattr(HomeAssistantDataSource, "_fetch_standing_charge", lambda self: 0)
+    monkeypatch.setattr(ha_module, "datetime", datetime)
+    data_source = HomeAssistantDataSource()
+    store = IntradayStore(str(tmp_path))
+
+    # Update at 10:40 and 11:20, while the 10:30 and 11:00 periods are still in progress
+    for now in [timedelta(hours=10, minutes=40), timedelta(hours=11, minutes=20)]:
+        home_assistant.now = home_assistant.midnight + now
+        freeze_now(home_assistant.now)
+        incremental = store.fetch_consumption(data_source, "mpan")
+
+    full = data_source.get_consumption_data(f"{date.today()}T00:00:00Z", f"{date.today()}T23:59:59Z")
+    assert {reading['readAt']: reading['consumptionDelta'] for reading in incremental} == \
+           {reading['readAt']: reading['consumptionDelta'] for reading in full}
+
+
+def test_meters_sharing_a_directory_keep_their_own_state(tmp_path):
+    first, second = IntradayStore(str(tmp_path)), IntradayStore(str(tmp_path))
+    first.meter("mpan-a")["last_read_at"] = "2024-01-10T10:00:00Z"
+    second.meter("mpan-b")["last_read_at"] = "2024-01-10T11:00:00Z"
+    first.save()
+    second.save()
+
+    reloaded = IntradayStore(str(tmp_path))
+    assert reloaded.meter("mpan-a")["last_read_at"] == "2024-01-10T10:00:00Z"
+    assert reloaded.meter("mpan-b")["last_read_at"] == "2024-01-10T11:00:00Z"
@@ -0,0 +1,58 @@
+from datetime import date
+import config
+import query_service
+import tariff_rules
+from main import calculate_potential_costs
+
+# Octopus Go in winter (UTC = UK time), as the REST API returns a day of it: newest first
+GO_API_RATES = [
+    {'valid_from': "2024-01-10T05:30:00Z", 'valid_to': "2024-01-11T00:00:00Z", 'value_inc_vat': 27.0, 'payment_method': None},
+    {'valid_from': "2024-01-10T00:30:00Z", 'valid_to': "2024-01-10T05:30:00Z", 'value_inc_vat': 8.5, 'payment_method': None},
+    {'valid_from': "2024-01-10T00:00:00Z", 'valid_to': "2024-01-10T00:30:00Z", 'value_inc_vat': 27.0, 'payment_method': None},
+]
+
+
+def half_hourly_profile(day: date):
+    return [{'readAt': f"{day}T{slot // 2:02d}:{slot % 2 * 30:02d}:00Z", 'consumptionDelta': 100 + slot}
+            for slot in range(48)]
+
+
+def test_generated_rates_cost_the_same_as_api_rates():
+    day = date(2024, 1, 10)
+    rule = tariff_rules.derive_rule("GO-VAR-22-10-14", "C", 40.0, GO_API_RATES, day)
+    profile = half_hourly_profile(day)
+
+    generated = calculate_potential_costs(profile, tariff_rules.day_unit_rates(rule, day))
+    downloaded = calculate_potential_costs(profile, GO_API_RATES)
+
+    assert generated == downloaded
+    # Readings on the window boundaries get the price of the window starting there
+    rates = {period['period_end']: period['rate'] for period in generated}
+    assert rates[f"{day}T00:30:00Z"] == 8.5
+    assert rates[f"{day}T05:30:00Z"] == 27.0
+
+
+def test_windows_follow_uk_time_in_summer():
+    rule = tariff_rules.derive_rule("GO-VAR-22-10-14", "C", 40.0, GO_API_RATES, date(2024, 1, 10))
+    rates = tariff_rules.day_unit_rates(rule, date(2024, 7, 1))
+    # Off-peak is 00:30-05:30 UK time, 23:30-04:30 UTC during BST
+    assert [(rate['valid_from'][11:16], rate['value_inc_vat']) for rate in rates] == \
+           [("23:30", 8.5), ("04:30", 27.0), ("00:00", 8.5)]
+
+
+def test_rule_is_derived_again_when_prices_change_without_the_standing_charge(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "TARIFF_RULES", True)
+    api_rates = GO_API_RATES
+    monkeypatch.setattr(query_service, "rest_query", lambda url: {'results': api_rates})
+
+    rule = tariff_rules.get_rule("GO-VAR-22-10-14", "C", 40.0, "https://api/rates/", date(2024, 1, 10))
+    assert tariff_rules.get_rule("GO-VAR-22-10-14", "C", 40.0, "https://api/rates/", date(2024, 1, 10)) == rule
+
+    # A day later the off-peak price has gone up, but the product code and standing charge are the same
+    api_rates = [dict(rate, value_inc_vat=9.0) if rate['value_inc_vat'] == 8.5 else rate for rate in GO_API_RATES]
+    rule["derived_at"] = "2024-01-10T00:00:00Z"
+    tariff_rules.save_rule(rule)
+
+    rule = tariff_rules.get_rule("GO-VAR-22-10-14", "C", 40.0, "https://api/rates/", date(2024, 1, 10))
+    assert [window['value_inc_vat'] for window in rule["windows"]] == [27.0, 9.0, 27.0]